@@ -0,0 +1,99 @@
+"""
+Size and CPU cost of zstd compression of AMQP bodies: likes digest chunks
+like likes_for_reviews produces them and per-user messages of the fan-out.
+Every level is compared to the plain json body, compression and
+decompression CPU is per message.
+
+Settings are read as usual, run it from src with .env in place (nothing
+is connected):
+
+    cd src && python ../benchmarks/amqp_compression.py --chunk-size 500
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import zstandard  # noqa: E402
+
+from core.config import amqp_settings  # noqa: E402
+from models.messages import encode  # noqa: E402
+
+LEVELS = (1, 3, 6, 9)
+
+
+def digest(users: int, reviews: int, movies: int, seed: int) -> dict:
+    """
+    One chunk of the likes digest, movies and reviews are repeated between
+    users like in real data
+    """
+    rnd = random.Random(seed)
+    titles = [(str(uuid.UUID(int=rnd.getrandbits(128))),
+               f'Movie title number {i} and a subtitle')
+              for i in range(movies)]
+    data = {}
+    for i in range(users):
+        likes = [[*rnd.choice(titles),
+                  f'Review text {rnd.randrange(1000)}'[:20],
+                  rnd.randrange(1, 500)]
+                 for _ in range(rnd.randrange(1, reviews + 1))]
+        data[str(uuid.UUID(int=rnd.getrandbits(128)))] = likes + [
+            [f'user{i}@example.com', f'First{i}', f'Last{i}']]
+    return data
+
+
+def measure(bodies: list[bytes], level: int) -> tuple[int, float, float]:
+    compressor = zstandard.ZstdCompressor(level=level)
+    decompressor = zstandard.ZstdDecompressor()
+
+    started = time.process_time()
+    compressed = [compressor.compress(body) for body in bodies]
+    compress_cpu = time.process_time() - started
+
+    started = time.process_time()
+    for body in compressed:
+        decompressor.decompress(body)
+    decompress_cpu = time.process_time() - started
+    return sum(map(len, compressed)), compress_cpu, decompress_cpu
+
+
+def report(name: str, bodies: list[bytes]) -> None:
+    size = sum(map(len, bodies))
+    print(f'{name}: {len(bodies)} messages, '
+          f'{size / len(bodies):.0f} bytes per message')
+    for level in LEVELS:
+        compressed, compress_cpu, decompress_cpu = measure(bodies, level)
+        mark = '*' if level == amqp_settings.compress_level else ' '
+        print(f'  level {level}{mark}: ratio {size / compressed:5.1f}, '
+              f'compress {compress_cpu / len(bodies) * 1e6:8.1f} us, '
+              f'decompress {decompress_cpu / len(bodies) * 1e6:7.1f} us')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunk-size', type=int, default=500,
+                        help='users in one digest message')
+    parser.add_argument('--chunks', type=int, default=20)
+    parser.add_argument('--reviews', type=int, default=5,
+                        help='max reviews of one user')
+    parser.add_argument('--movies', type=int, default=2000)
+    args = parser.parse_args()
+
+    chunks = [digest(args.chunk_size, args.reviews, args.movies, seed)
+              for seed in range(args.chunks)]
+    report('digest chunks', [encode(chunk) for chunk in chunks])
+    # Per-user messages produced by fan-out
+    report('fan-out messages', [encode({user_id: likes})
+                                for chunk in chunks
+                                for user_id, likes in chunk.items()])
+    print(f'* RABBIT_COMPRESS_LEVEL, bodies of '
+          f'{amqp_settings.compress_min_size} bytes and bigger are '
+          f'compressed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+SQLAlchemy CPU spent on the per-message DB statements of the consumer:
+the idempotency check and the grouped status UPDATE.
+
+`before` builds the statements on every call like DbHelpers.select and
+DbHelpers.update_many do, `after` executes statements defined once with
+bound parameters. Statements go through Connection.execute of an engine
+with a stub DBAPI connection: cache key, compiled cache lookup, parameters
+and expansion of IN lists are the same as with a database. Number of
+distinct SQL texts is counted by `before_cursor_execute` event, it's the
+number of statements asyncpg has to prepare on every connection.
+
+Settings are read as usual, run it from src with .env in place (nothing
+is connected):
+
+    cd src && python ../benchmarks/db_statements.py --messages 20000
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from sqlalchemy import (Connection, create_engine, event, select,  # noqa: E402
+                        update)
+from sqlalchemy.dialects import registry  # noqa: E402
+from sqlalchemy.dialects.postgresql.base import PGDialect  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+
+from message_worker import notification_status, sent_status  # noqa: E402
+from models.schemas import Notification  # noqa: E402
+
+# Answers to the queries dialect runs on the first connect
+SERVER = {
+    'select pg_catalog.version()': 'PostgreSQL 15.4',
+    'select current_schema()': 'notify',
+    'show transaction isolation level': 'read committed',
+    'show standard_conforming_strings': 'on',
+}
+
+
+class Cursor:
+    """
+    DBAPI cursor that executes nothing, statements return no rows
+    """
+    description: list | None = None
+    rowcount = 0
+
+    def __init__(self) -> None:
+        self.rows: list[tuple] = []
+
+    def execute(self, statement: str, parameters=None) -> None:
+        if statement in SERVER:
+            self.description = [('value', None, None, None, None, None,
+                                 None)]
+            self.rows = [(SERVER[statement],)]
+
+    def fetchone(self) -> tuple | None:
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self) -> list[tuple]:
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self) -> None:
+        pass
+
+
+class DbapiConnection:
+    def cursor(self) -> Cursor:
+        return Cursor()
+
+    def commit(self) -> None:
+        pass
+
+    def rollback(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class StubDbapi:
+    paramstyle = 'pyformat'
+    Error = Exception
+
+
+class StubDialect(PGDialect):
+    driver = 'stub'
+    supports_statement_cache = True
+
+    @classmethod
+    def import_dbapi(cls):
+        return StubDbapi
+
+
+registry.register('postgresql.stub', __name__, 'StubDialect')
+
+
+def before(conn: Connection, ids: list[str], group: int) -> None:
+    for correlation_id in ids:
+        query = select(Notification).filter(
+            Notification.content_id == correlation_id).offset(0).limit(10)
+        conn.execute(query)
+    for i in range(0, len(ids), group):
+        statement = update(Notification).where(
+            Notification.content_id.in_(ids[i:i + group])).values(
+            **sent_status.update_values())
+        conn.execute(statement)
+
+
+def after(conn: Connection, ids: list[str], group: int) -> None:
+    for correlation_id in ids:
+        conn.execute(notification_status, {'content_id': correlation_id})
+    for i in range(0, len(ids), group):
+        update_values = sent_status.update_values()
+        params = {f'new_{key}': value for key, value in update_values.items()}
+        params['column_values'] = ids[i:i + group]
+        conn.execute(sent_status.update_statement(update_values), params)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--group', type=int, default=20,
+                        help='max messages in one status UPDATE')
+    args = parser.parse_args()
+
+    ids = [f'{datetime.utcnow():%Y-%m-%d}:{i}' for i in range(args.messages)]
+    # Groups of different size, like in BulkUpdater under real load
+    for name, run in (('before', before), ('after', after)):
+        engine = create_engine('postgresql+stub://',
+                               creator=DbapiConnection,
+                               poolclass=StaticPool)
+        texts: set[str] = set()
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def count(conn, cursor, statement, parameters, context,
+                  executemany):
+            texts.add(statement)
+
+        with engine.connect() as conn:
+            started = time.process_time()
+            for group in range(1, args.group + 1):
+                run(conn, ids[:args.messages // args.group], group)
+            elapsed = time.process_time() - started
+        engine.dispose()
+        print(f'{name:>6}: {elapsed / args.messages * 1e6:8.1f} us CPU per '
+              f'message, {len(texts)} distinct statements')
+
+
+if __name__ == '__main__':
+    main()
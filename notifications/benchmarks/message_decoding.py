@@ -0,0 +1,88 @@
+"""
+CPU per consumed message: orjson.loads into untyped dicts against decoding
+of the envelope into typed payload by routing key (msgspec validates while
+it parses). Registered user, likes digest chunk and per-user likes
+messages are decoded.
+
+Settings are read as usual, run it from src with .env in place (nothing
+is connected):
+
+    cd src && python ../benchmarks/message_decoding.py --messages 20000
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import orjson  # noqa: E402
+
+from amqp_compression import digest  # noqa: E402
+from models.messages import LIKES_FOR_REVIEWS, REGISTERED, \
+    USER_LIKES_FOR_REVIEWS, decode, encode  # noqa: E402
+
+
+def registered(count: int) -> list[bytes]:
+    # Auth service returns more fields than the email needs
+    return [encode({'id': str(uuid.UUID(int=i)),
+                    'email': f'user{i}@example.com',
+                    'first_name': f'First{i}',
+                    'last_name': f'Last{i}',
+                    'disabled': False,
+                    'is_admin': False,
+                    'roles': []}) for i in range(count)]
+
+
+def user_likes(chunks: list[dict]) -> list[bytes]:
+    # Built like fan_out_likes builds them
+    bodies = []
+    for chunk in chunks:
+        for user_id, likes in chunk.items():
+            email, first_name, last_name = likes[-1]
+            bodies.append(encode({'id': user_id,
+                                  'email': email,
+                                  'first_name': first_name,
+                                  'last_name': last_name,
+                                  'reviews': likes[:-1]}))
+    return bodies
+
+
+def measure(name: str, routing_key: str, bodies: list[bytes]) -> None:
+    started = time.process_time()
+    for body in bodies:
+        orjson.loads(body)
+    loads_cpu = time.process_time() - started
+
+    started = time.process_time()
+    for body in bodies:
+        decode(routing_key, body)
+    decode_cpu = time.process_time() - started
+
+    size = sum(map(len, bodies)) / len(bodies)
+    print(f'{name:>12} ({size:6.0f} bytes): '
+          f'orjson {loads_cpu / len(bodies) * 1e6:8.1f} us, '
+          f'typed {decode_cpu / len(bodies) * 1e6:8.1f} us per message')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=20000,
+                        help='registered and per-user likes messages')
+    parser.add_argument('--chunk-size', type=int, default=500,
+                        help='users in one digest message')
+    parser.add_argument('--reviews', type=int, default=5,
+                        help='max reviews of one user')
+    args = parser.parse_args()
+
+    chunks = [digest(args.chunk_size, args.reviews, 2000, seed)
+              for seed in range(max(args.messages // args.chunk_size, 1))]
+    measure('registered', REGISTERED, registered(args.messages))
+    measure('digest chunk', LIKES_FOR_REVIEWS,
+            [encode(chunk) for chunk in chunks])
+    measure('user likes', USER_LIKES_FOR_REVIEWS, user_likes(chunks))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+CPU per recipient of the likes digest: full Jinja render of the template
+against the split template, where the skeleton is rendered once and only
+slot values are rendered for every recipient.
+
+Settings are read as usual, run it from src with .env in place (nothing
+is connected):
+
+    cd src && python ../benchmarks/split_templates.py --recipients 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from message_worker.templates import TEMPLATES_PATH, \
+    TemplateRegistry  # noqa: E402
+
+TEMPLATE = 'email_likes_for_review.html'
+
+
+def recipients(count: int, reviews: int) -> list[dict]:
+    rnd = random.Random(0)
+    return [{'first_name': f'First{i}',
+             'last_name': f'Last{i}',
+             'reviews': [[f'movie-{rnd.randrange(1000)}',
+                          f'Movie title {rnd.randrange(1000)}',
+                          'Review text shortened',
+                          rnd.randrange(1, 500)]
+                         for _ in range(rnd.randrange(1, reviews + 1))]}
+            for i in range(count)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recipients', type=int, default=100000)
+    parser.add_argument('--reviews', type=int, default=5,
+                        help='max reviews of one recipient')
+    args = parser.parse_args()
+
+    registry = TemplateRegistry(TEMPLATES_PATH)
+    registry.load()
+    template = registry.get(TEMPLATE)
+    split = registry.split(TEMPLATE)
+    contexts = recipients(args.recipients, args.reviews)
+
+    started = time.process_time()
+    full = [template.render(**context) for context in contexts]
+    full_cpu = time.process_time() - started
+
+    started = time.process_time()
+    slots = [split.slots(**context) for context in contexts]
+    slots_cpu = time.process_time() - started
+
+    # Full html is still built for single emails
+    started = time.process_time()
+    assembled = [split.assemble(values) for values in slots]
+    assemble_cpu = time.process_time() - started
+    assert assembled == full
+
+    full_bytes = sum(len(html.encode()) for html in full)
+    slots_bytes = sum(len(tag) + len(value.encode())
+                      for values in slots for tag, value in values.items())
+    print(f'{args.recipients} recipients')
+    for name, cpu, size in (('full render', full_cpu, full_bytes),
+                            ('slots', slots_cpu, slots_bytes),
+                            ('slots + assemble', slots_cpu + assemble_cpu,
+                             full_bytes)):
+        print(f'{name:>16}: {cpu / args.recipients * 1e6:6.1f} us CPU, '
+              f'{size / args.recipients:6.0f} bytes per recipient')
+
+
+if __name__ == '__main__':
+    main()
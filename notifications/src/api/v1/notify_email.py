@@ -1,20 +1,22 @@
-import ast
 import logging
 from typing import Annotated
+from uuid import UUID
 
-from fastapi import APIRouter, status, Depends
+from fastapi import APIRouter, Query, Response, status, Depends
 from fastapi.encoders import jsonable_encoder
 
 import core.config as conf
-from db.rabbit import BrokerDep
 from models.email import RequestUserModel
+from models.messages import REGISTERED
 from models.model import PaginateModel
-from models.notifications import NotificationsHistoryModel
+from models.notifications import DEFAULT_HISTORY_FIELDS, HistoryField, \
+    NotificationHtmlModel, NotificationsHistoryModel
 from services.connections import DbDep, DbHelpers
 from services.exceptions import user_doesnt_exist
 from services.helpers import initiate_notification_helper, api_post_helper, \
-    get_notification_history_helper, api_get_helper
-from services.token import security_jwt
+    get_notification_history_helper, encode_cursor, \
+    get_notification_html_helper, render_notification_html
+from services.token import get_user, security_jwt
 
 # Объект router, в котором регистрируем обработчики
 router = APIRouter()
@@ -25,11 +27,10 @@ Paginate = Annotated[PaginateModel, Depends(PaginateModel)]
              status_code=status.HTTP_201_CREATED,
              description="send welcome email to user", )
 async def user_welcome(user: RequestUserModel,
-                       broker: BrokerDep,
                        db: DbDep):
     conn = DbHelpers(db)
     correlation_id = str(user.user_id)
-    routing_key = 'user-reporting.v1.registered'
+    routing_key = REGISTERED
 
     url = f'http://{conf.settings.host_auth}:' \
           f'{conf.settings.port_auth}' \
@@ -42,47 +43,76 @@ async def user_welcome(user: RequestUserModel,
 
     data = jsonable_encoder(data_users[0])
     await initiate_notification_helper(conn,
-                                       broker,
                                        correlation_id,
                                        routing_key,
                                        data)
 
 
+async def current_user(
+        token: Annotated[str, Depends(security_jwt)]) -> dict:
+    """
+    Getting user data from token
+    """
+    return await get_user(token)
+
+
 @router.get('/get-notifications-history',
             response_model=list[NotificationsHistoryModel],
+            response_model_exclude_unset=True,
             status_code=status.HTTP_200_OK,
             description="получение истории уведомлений",
-            response_description="user_email, message")
-async def get_history(pagination: Paginate,
-                      token: Annotated[str, Depends(security_jwt)],
-                      db: DbDep) -> list[NotificationsHistoryModel]:
+            response_description="Requested fields of notifications. Cursor "
+                                 "of the next page is returned in "
+                                 "X-Next-Cursor header")
+async def get_history(
+        pagination: Paginate,
+        user_data: Annotated[dict, Depends(current_user)],
+        db: DbDep,
+        response: Response,
+        fields: Annotated[
+            list[HistoryField],
+            Query(description='Fields to return. html_content is returned '
+                              'only if it is requested.')
+        ] = DEFAULT_HISTORY_FIELDS) -> list[NotificationsHistoryModel]:
     page = pagination.page_number
     size = pagination.page_size
+    names = [field.value for field in fields]
 
     conn = DbHelpers(db)
-
-    # Getting user id from token
-    url = f'http://{conf.settings.host_auth}:'\
-          f'{conf.settings.port_auth}'\
-          f'/api/v1/users/me'
-    headers = {'Authorization': f'Bearer {token}'}
-    user_data = await api_get_helper(url, headers)
-
     data = await get_notification_history_helper(conn,
                                                  user_data['id'],
                                                  page,
-                                                 size)
+                                                 size,
+                                                 pagination.cursor,
+                                                 names)
+    rows = data.mappings().all()
+    if len(rows) == size:
+        response.headers['X-Next-Cursor'] = encode_cursor(
+            rows[-1]['last_notification_send'], rows[-1]['id'])
 
     res = []
-    for notification in data:
-        notification = jsonable_encoder(*notification)
-        res.append(
-            NotificationsHistoryModel(
-                user_email=notification['user_email'],
-                message_content=ast.literal_eval(
-                    notification['message_content']),
-                html_content=notification['html_content'],
-                last_notification_send=notification['last_notification_send']
-            )
-        )
+    for row in rows:
+        notification = {name: row[name] for name in names}
+        if HistoryField.html_content in fields:
+            notification['html_content'] = await render_notification_html(
+                row['html_content'],
+                row['message_content'],
+                row['template_hash'])
+        res.append(NotificationsHistoryModel(**notification))
     return res
+
+
+@router.get('/get-notification-html/{notification_id}',
+            response_model=NotificationHtmlModel,
+            status_code=status.HTTP_200_OK,
+            description="получение html уведомления",
+            response_description="id, html_content")
+async def get_html(notification_id: UUID,
+                   user_data: Annotated[dict, Depends(current_user)],
+                   db: DbDep) -> NotificationHtmlModel:
+    conn = DbHelpers(db)
+    html_content = await get_notification_html_helper(conn,
+                                                      user_data['id'],
+                                                      notification_id)
+    return NotificationHtmlModel(id=notification_id,
+                                 html_content=html_content)
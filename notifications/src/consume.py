@@ -1,9 +1,14 @@
 import asyncio
 import logging
+import signal
 
-from core.config import amqp_settings, db_settings
+from core.config import amqp_settings, consumer_settings, db_settings, \
+    history_settings
 from db.rabbit import Rabbit
 from db import postgres as db
+from message_worker import templates, transport as email
+from message_worker.router import ROUTING_KEYS
+from services import history, http_client as http
 
 
 async def startup_db():
@@ -14,26 +19,103 @@ async def startup_db():
         f'{db_settings.user}:{db_settings.password}@'
         f'{db_settings.host}:{db_settings.port}/'
         f'{db_settings.dbname}')
+    db.postgres.start_metrics(db_settings.pool_metrics_interval)
+
+
+async def shutdown_db():
+    if db.postgres:
+        await db.postgres.close()
+
+
+async def startup_transport():
+    logging.info("Creating email transport...")
+    email.transport = email.create_transport()
+
+
+async def shutdown_transport():
+    if email.transport:
+        await email.transport.close()
+
+
+async def startup_templates():
+    logging.info("Loading email templates...")
+    templates.templates = templates.create_template_registry()
+    await templates.templates.register()
+
+
+async def shutdown_templates():
+    if templates.templates:
+        logging.info(f'Email templates render time: '
+                     f'{templates.templates.render_timings()}')
+
+
+async def startup_http():
+    http.http_client = http.create_http_client()
+
+
+async def shutdown_http():
+    if http.http_client:
+        await http.http_client.close()
+
+
+async def startup_history():
+    history.history_writer = history.HistoryWriter(
+        size=history_settings.batch_size,
+        interval=history_settings.flush_interval,
+        max_rows=history_settings.max_rows)
+
+
+async def shutdown_history():
+    # Write everything that is buffered
+    if history.history_writer:
+        await history.history_writer.close()
 
 
 async def startup_consumer():
     logging.info("Starting consumer...")
     rabbit = Rabbit()
+    # Graceful shutdown: finish in-flight messages, requeue the rest
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, rabbit.stop)
+
     await rabbit.connect(amqp_settings.get_amqp_uri(),
-                         queue_name='email_worker')
-    await rabbit.consume(routing_key="user-reporting.v1.registered")
-    await rabbit.consume(routing_key="user-reporting.v1.likes-for-reviews")
+                         queue_name='email_worker',
+                         prefetch_count=consumer_settings.prefetch_count,
+                         routing_keys=ROUTING_KEYS)
+    for routing_key in ROUTING_KEYS:
+        await rabbit.consume(routing_key=routing_key)
     try:
-        await rabbit.iterate()
+        await rabbit.iterate(concurrency=consumer_settings.concurrency)
     except Exception:
+        logging.exception('Consumer has crashed.')
         await rabbit.close()
+        raise
 
 
 async def main():
-    await asyncio.gather(startup_consumer(), startup_db())
+    await startup_db()
+    await startup_transport()
+    await startup_templates()
+    await startup_history()
+    await startup_http()
+    try:
+        await startup_consumer()
+    finally:
+        await shutdown_http()
+        await shutdown_history()
+        await shutdown_templates()
+        await shutdown_transport()
+        await shutdown_db()
 
-if __name__ == "__main__":
+
+def run():
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
-        logging.info('Consumer has been closed.')
+        pass
+    logging.info('Consumer has been closed.')
+
+
+if __name__ == "__main__":
+    run()
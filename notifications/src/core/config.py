@@ -4,7 +4,7 @@ from logging import config as logging_config
 
 from core.logger import LOGGING
 from dotenv import load_dotenv
-from pydantic import Field, BaseSettings
+from pydantic import Field, BaseSettings, validator
 
 # Применяем настройки логирования
 logging_config.dictConfig(LOGGING)
@@ -31,6 +31,37 @@ class Settings(MainConf):
 settings = Settings()
 
 
+class AuthSettings(MainConf):
+    token_cache_size: int = Field(10000, env="AUTH_TOKEN_CACHE_SIZE")
+    token_cache_ttl: float = Field(60, env="AUTH_TOKEN_CACHE_TTL")
+    # Tokens are verified locally if public key of auth service is set
+    jwt_public_key: str | None = Field(None, env="AUTH_JWT_PUBLIC_KEY")
+    jwt_algorithm: str = Field('RS256', env="AUTH_JWT_ALGORITHM")
+    jwt_user_id_claim: str = Field('sub', env="AUTH_JWT_USER_ID_CLAIM")
+
+    @property
+    def public_key(self) -> str | None:
+        # PEM might be set in one line with escaped line breaks
+        if self.jwt_public_key:
+            return self.jwt_public_key.replace('\\n', '\n')
+        return None
+
+
+auth_settings = AuthSettings()
+
+
+class HttpSettings(MainConf):
+    limit_per_host: int = Field(100, env="HTTP_LIMIT_PER_HOST")
+    keepalive_timeout: float = Field(30, env="HTTP_KEEPALIVE_TIMEOUT")
+    timeout: float = Field(10, env="HTTP_TIMEOUT")
+    connect_timeout: float = Field(3, env="HTTP_CONNECT_TIMEOUT")
+    retries: int = Field(2, env="HTTP_RETRIES")
+    retry_backoff: float = Field(0.2, env="HTTP_RETRY_BACKOFF")
+
+
+http_settings = HttpSettings()
+
+
 class MongoCreds(MainConf):
     host: str = Field(..., env="MONGO_HOST")
     port: str = Field(..., env="MONGO_PORT")
@@ -47,6 +78,12 @@ class RabbitCreds(MainConf):
     rabbit_port: str = Field(..., env="RABBIT_PORT")
     rabbit_user: str = Field(..., env="RABBIT_USER")
     rabbit_pass: str = Field(..., env="RABBIT_PASS")
+    # Publishing channels used by concurrent producers
+    channel_pool_size: int = Field(10, env="RABBIT_CHANNEL_POOL_SIZE")
+    # Bodies of this size in bytes and bigger are compressed with zstd,
+    # 0 disables compression
+    compress_min_size: int = Field(4096, env="RABBIT_COMPRESS_MIN_SIZE")
+    compress_level: int = Field(3, env="RABBIT_COMPRESS_LEVEL")
 
     def get_amqp_uri(self):
         url = f"amqp://{self.rabbit_user}"\
@@ -60,6 +97,17 @@ class RabbitCreds(MainConf):
 amqp_settings = RabbitCreds()
 
 
+class ConsumerSettings(MainConf):
+    prefetch_count: int = Field(20, env="CONSUMER_PREFETCH_COUNT")
+    concurrency: int = Field(10, env="CONSUMER_CONCURRENCY")
+    workers: int = Field(os.cpu_count() or 1, env="CONSUMER_WORKERS")
+    restart_delay: float = Field(5, env="CONSUMER_RESTART_DELAY")
+    shutdown_timeout: float = Field(30, env="CONSUMER_SHUTDOWN_TIMEOUT")
+
+
+consumer_settings = ConsumerSettings()
+
+
 class DBCreds(MainConf):
     dbname: str = Field(..., env="DB_NAME")
     user: str = Field(..., env="DB_USER")
@@ -67,11 +115,44 @@ class DBCreds(MainConf):
     host: str = Field(env="DB_HOST", default='127.0.0.1')
     port: int = Field(env="DB_PORT", default=5432)
     echo: bool = os.getenv('ENGINE_ECHO', 'False') == 'True'
+    # Connections kept open and opened above it under load
+    pool_size: int = Field(10, env="DB_POOL_SIZE")
+    max_overflow: int = Field(10, env="DB_MAX_OVERFLOW")
+    # Seconds to wait for a free connection
+    pool_timeout: float = Field(30, env="DB_POOL_TIMEOUT")
+    pool_recycle: int = Field(1800, env="DB_POOL_RECYCLE")
+    # Seconds of waiting for a connection that are logged
+    pool_wait_warning: float = Field(1, env="DB_POOL_WAIT_WARNING")
+    # Seconds between pool metrics in log, 0 disables them
+    pool_metrics_interval: float = Field(60, env="DB_POOL_METRICS_INTERVAL")
+    # Milliseconds
+    statement_timeout: int = Field(30000, env="DB_STATEMENT_TIMEOUT")
+    prepared_statement_cache_size: int = Field(
+        500, env="DB_PREPARED_STATEMENT_CACHE_SIZE")
 
 
 db_settings = DBCreds()
 
 
+class HistorySettings(MainConf):
+    batch_size: int = Field(500, env="HISTORY_BATCH_SIZE")
+    flush_interval: float = Field(1, env="HISTORY_FLUSH_INTERVAL")
+    # Rows kept in memory while DB is unavailable
+    max_rows: int = Field(10000, env="HISTORY_MAX_ROWS")
+
+
+history_settings = HistorySettings()
+
+
+class OutboxSettings(MainConf):
+    # Messages published by the relay in one transaction
+    batch_size: int = Field(500, env="OUTBOX_BATCH_SIZE")
+    poll_interval: float = Field(1, env="OUTBOX_POLL_INTERVAL")
+
+
+outbox_settings = OutboxSettings()
+
+
 class CronSettings:
     likes_for_reviews: dict = {
         'hour': 14,
@@ -88,14 +169,65 @@ class CronSettings:
     process_consumed_notifications: dict = {
         'minute': 5,
     }
+    manage_partitions: dict = {
+        'hour': 3,
+        'minute': 0,
+        'timezone': 'UTC'
+    }
 
 
 cron_settings = CronSettings()
 
 
+class PartitionSettings(MainConf):
+    # Monthly partitions created ahead of the current one
+    premake: int = Field(2, env="PARTITIONS_PREMAKE")
+    # Months of data kept, older partitions are dropped. 0 - keep forever
+    notifications_retention: int = Field(
+        6, env="NOTIFICATIONS_RETENTION_MONTHS")
+    history_retention: int = Field(0, env="HISTORY_RETENTION_MONTHS")
+
+
+partition_settings = PartitionSettings()
+
+
+class DigestSettings(MainConf):
+    # Users in one likes for reviews message
+    chunk_size: int = Field(500, env="LIKES_CHUNK_SIZE")
+    # Split chunk into message for every user. Every user is tracked and
+    # retried separately, but gets own SendGrid request and full template
+    # render instead of batched personalizations of the chunk
+    fan_out: bool = Field(False, env="LIKES_FAN_OUT")
+
+
+digest_settings = DigestSettings()
+
+
 class EmailSettings(MainConf):
     sg_api_key: str = Field(..., env="SENDGRID_API_KEY")
     from_email: str = Field(..., env="FROM_EMAIL")
+    # sendgrid - deliver with SendGrid, fake - keep emails in memory
+    transport: str = Field('sendgrid', env="EMAIL_TRANSPORT")
+    sg_api_url: str = Field('https://api.sendgrid.com/v3/mail/send',
+                            env="SENDGRID_API_URL")
+    sg_timeout: float = Field(10, env="SENDGRID_TIMEOUT")
+    sg_pool_size: int = Field(100, env="SENDGRID_POOL_SIZE")
+    sg_keepalive_timeout: float = Field(30, env="SENDGRID_KEEPALIVE_TIMEOUT")
+    # SendGrid accepts up to 1000 personalizations per request
+    sg_batch_size: int = Field(1000, env="SENDGRID_BATCH_SIZE")
+    # Partially delivered message is retried until it fails this many times
+    max_delivery_failures: int = Field(5, env="EMAIL_MAX_DELIVERY_FAILURES")
+    fake_latency: float = Field(0, env="EMAIL_FAKE_LATENCY")
+    # Compiled templates survive restarts, system temp dir by default
+    template_cache_dir: str | None = Field(None, env="TEMPLATE_CACHE_DIR")
+    # Check template files for changes on every render (development)
+    template_auto_reload: bool = Field(False, env="TEMPLATE_AUTO_RELOAD")
+    template_async: bool = Field(False, env="TEMPLATE_ASYNC")
+
+    @validator('template_cache_dir')
+    def empty_cache_dir(cls, value: str | None) -> str | None:
+        # Empty value means the default dir, not the current one
+        return value or None
 
 
 email_settings = EmailSettings()
@@ -23,7 +23,9 @@ class AbstractQueueInternal(ABC):
     @abstractmethod
     async def connect(self, url: str,
                       topic_name: str,
-                      queue_name: str):
+                      queue_name: str,
+                      prefetch_count: int,
+                      routing_keys):
         pass
 
     @abstractmethod
@@ -33,6 +35,12 @@ class AbstractQueueInternal(ABC):
                       correlation_id):
         pass
 
+    @abstractmethod
+    async def produce_many(self,
+                           batch: list[tuple[str, dict, str]]
+                           ) -> list[str]:
+        pass
+
     @abstractmethod
     async def consume(self, routing_key: str):
         pass
@@ -1,7 +1,15 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import orjson
 from sqlalchemy import MetaData
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, \
     async_sessionmaker
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from core.config import db_settings
 from db import AbstractStorage
@@ -10,19 +18,104 @@ from db import AbstractStorage
 Base = declarative_base(metadata=MetaData(schema='notify'))
 
 
+def json_serializer(obj) -> str:
+    return orjson.dumps(obj).decode()
+
+
+class MeteredPool(AsyncAdaptedQueuePool):
+    """
+    Connection pool that measures how long checkouts wait for a free
+    connection.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            wait = time.perf_counter() - started
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            if wait > db_settings.pool_wait_warning:
+                logging.warning(f'Waited {wait:.3f}s for DB connection. '
+                                f'{self.status()}')
+
+
 class Postgres(AbstractStorage):
     def __init__(self, url: str):
         echo = db_settings.echo
-        self.engine = create_async_engine(url,
-                                          echo=echo,
-                                          future=True)
+        # JSONB is encoded with orjson and sent with asyncpg binary codec
+        self.engine = create_async_engine(
+            url,
+            echo=echo,
+            future=True,
+            json_serializer=json_serializer,
+            json_deserializer=orjson.loads,
+            poolclass=MeteredPool,
+            pool_size=db_settings.pool_size,
+            max_overflow=db_settings.max_overflow,
+            pool_timeout=db_settings.pool_timeout,
+            pool_recycle=db_settings.pool_recycle,
+            # Connections dropped by server are replaced before use
+            pool_pre_ping=True,
+            connect_args={
+                'server_settings': {
+                    'statement_timeout': str(db_settings.statement_timeout)},
+                # Statements prepared by asyncpg are kept per connection
+                'prepared_statement_cache_size':
+                    db_settings.prepared_statement_cache_size})
 
         self.async_session = async_sessionmaker(self.engine,
                                                 class_=AsyncSession,
                                                 expire_on_commit=False)
+        self.metrics_task: asyncio.Task | None = None
+
+    def pool_metrics(self) -> dict:
+        pool: MeteredPool = self.engine.pool  # type: ignore[assignment]
+        return {
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': pool.overflow(),
+            'checkouts': pool.checkouts,
+            'wait_total': pool.wait_total,
+            'wait_max': pool.wait_max,
+        }
+
+    def start_metrics(self, interval: float) -> None:
+        """
+        Log pool metrics every `interval` seconds while the process runs
+        """
+        if interval > 0:
+            self.metrics_task = asyncio.create_task(
+                self.log_metrics(interval))
+
+    async def log_metrics(self, interval: float) -> None:
+        checkouts, wait_total = 0, 0.0
+        while True:
+            await asyncio.sleep(interval)
+            metrics = self.pool_metrics()
+            # Waiting during the last interval
+            count = metrics['checkouts'] - checkouts
+            wait = metrics['wait_total'] - wait_total
+            checkouts, wait_total = metrics['checkouts'], metrics['wait_total']
+            logging.info(f'DB pool: {metrics}, checkouts in the last '
+                         f'{interval}s: {count}, avg wait: '
+                         f'{wait / count if count else 0:.4f}s')
 
     async def close(self):
-        ...
+        if self.metrics_task:
+            self.metrics_task.cancel()
+            self.metrics_task = None
+        logging.info(f'Closing DB connections. Pool: {self.pool_metrics()}')
+        await self.engine.dispose()
 
 
 postgres: Postgres | None = None
@@ -30,8 +123,18 @@ postgres: Postgres | None = None
 
 # Функция понадобится при внедрении зависимостей
 # Dependency
-async def get_session() -> AsyncSession | None:
-    if postgres:
-        async with postgres.async_session() as session:
-            return session
-    return None
+async def get_session() -> AsyncIterator[AsyncSession]:
+    """
+    Session of one request, it is closed after the response is sent
+    """
+    async with postgres.async_session() as session:  # type: ignore
+        yield session
+
+
+@asynccontextmanager
+async def db_session() -> AsyncIterator[AsyncSession]:
+    """
+    Session of one task (scheduler job, consumed message)
+    """
+    async with postgres.async_session() as session:  # type: ignore
+        yield session
@@ -1,54 +1,199 @@
 import asyncio
 import logging
+from contextlib import asynccontextmanager
 from datetime import datetime
 from functools import lru_cache
-from typing import Annotated
+from typing import Annotated, AsyncIterator, Iterable
 
-import orjson
+import zstandard
 
-from aio_pika import DeliveryMode, Exchange, ExchangeType, connect_robust
-from aio_pika.abc import AbstractQueue
-from aio_pika.channel import Channel
-from aio_pika.connection import Connection
+from aio_pika import DeliveryMode, ExchangeType, connect_robust
+from aio_pika.abc import (AbstractChannel, AbstractExchange,
+                          AbstractIncomingMessage, AbstractQueue,
+                          AbstractRobustConnection)
 from aio_pika.message import Message
 from fastapi import Depends
 from sqlalchemy.exc import SQLAlchemyError
 
+from core.config import amqp_settings
 from db import AbstractQueueInternal
+from models import messages
 from models.schemas import Notification
-from services.connections import get_db, DbHelpers
+from services.connections import BulkUpdater
 from services.exceptions import db_bad_request
 
-from message_worker.send_emails import Email
+from message_worker.router import route
+
+
+ZSTD = 'zstd'
+
+# Compression contexts are reused, every process has its own
+compressor = zstandard.ZstdCompressor(level=amqp_settings.compress_level)
+decompressor = zstandard.ZstdDecompressor()
+
+# Concurrently consumed messages are moved to `Consumed` with one UPDATE
+consumed_status = BulkUpdater(
+    model=Notification,
+    model_column=Notification.content_id,
+    update_values=lambda: {'status': 'Consumed',
+                           'failures': 0,
+                           'modified': datetime.utcnow()})
+
+
+class ChannelPool:
+    """
+    Publishing channels shared by concurrent producers. aio-pika writes
+    frames of one channel sequentially, so every producer takes its own
+    channel. Channels are opened lazily up to `size`, closed channels are
+    replaced on the next acquire. Exchange object is kept with its channel.
+    """
+
+    def __init__(self,
+                 connection: AbstractRobustConnection,
+                 topic_name: str,
+                 size: int) -> None:
+        self.connection = connection
+        self.topic_name = topic_name
+        self.size = size
+        self.opened = 0
+        # None is a slot of channel that has to be reopened
+        self.free: asyncio.Queue[
+            tuple[AbstractChannel, AbstractExchange] | None] = asyncio.Queue()
+
+    async def open(self) -> tuple[AbstractChannel, AbstractExchange]:
+        channel = await self.connection.channel(publisher_confirms=True)
+        # Exchange is declared on connect, no need to check it again
+        exchange = await channel.get_exchange(self.topic_name, ensure=False)
+        return channel, exchange
+
+    async def get(self) -> tuple[AbstractChannel, AbstractExchange]:
+        if self.free.empty() and self.opened < self.size:
+            self.opened += 1
+            try:
+                return await self.open()
+            except Exception:
+                self.opened -= 1
+                raise
+
+        item = await self.free.get()
+        if item is None or item[0].is_closed:
+            logging.warning('Rabbit channel is closed. Opening a new one.')
+            try:
+                return await self.open()
+            except Exception:
+                self.free.put_nowait(None)
+                raise
+        return item
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[AbstractExchange]:
+        item = await self.get()
+        try:
+            yield item[1]
+        finally:
+            self.free.put_nowait(None if item[0].is_closed else item)
+
+    async def close(self) -> None:
+        while not self.free.empty():
+            item = self.free.get_nowait()
+            if item and not item[0].is_closed:
+                await item[0].close()
+        self.opened = 0
 
 
 class Rabbit(AbstractQueueInternal):
     def __init__(self) -> None:
-        self.connection: Connection | None = None
-        self.channel: Channel | None = None
-        self.exchange: Exchange | None = None
+        self.connection: AbstractRobustConnection | None = None
+        self.channel: AbstractChannel | None = None
+        self.exchange: AbstractExchange | None = None
+        self.consumer_channel: AbstractChannel | None = None
+        self.pool: ChannelPool | None = None
+        self.bound_keys: set[str] = set()
         self.topic_name: str | None = None
         self.queue_name: str | None = None
         self.queue: AbstractQueue | None = None
+        self.prefetch_count: int = 0
+        self.stop_event = asyncio.Event()
 
     async def connect(self,
                       url: str,
                       topic_name: str = 'topic_v1',
-                      queue_name: str = 'queue_v1'):
+                      queue_name: str = 'queue_v1',
+                      prefetch_count: int = 0,
+                      routing_keys: Iterable[str] = ()):
+        """
+        Connect and declare topology once: exchange, durable queue and its
+        bindings. Messages are published through the pool of channels that
+        wait for broker confirms.
+        :param url:
+        :param topic_name: exchange name
+        :param queue_name:
+        :param prefetch_count: unacked messages per consumer
+        :param routing_keys: keys bound to the queue
+        :return:
+        """
         self.topic_name = topic_name
         self.queue_name = queue_name
-        self.connection = await connect_robust(
+        self.prefetch_count = prefetch_count
+        self.connection = connection = await connect_robust(
             url=url,
             loop=asyncio.get_running_loop()
         )
 
-        self.channel = await self.connection.channel()
+        self.channel = channel = await connection.channel()
+
+        self.exchange = await channel.declare_exchange(self.topic_name,
+                                                       ExchangeType.TOPIC)
+        self.queue = await channel.declare_queue(self.queue_name,
+                                                 durable=True)
+        for routing_key in routing_keys:
+            await self.bind(routing_key)
+
+        self.pool = ChannelPool(connection,
+                                topic_name,
+                                amqp_settings.channel_pool_size)
 
-        self.exchange = \
-            await self.channel.declare_exchange(  # type: ignore[union-attr]
-                self.topic_name,
-                ExchangeType.TOPIC
-            )
+    async def bind(self, routing_key: str) -> None:
+        if routing_key in self.bound_keys:
+            return
+        if self.queue is None or self.exchange is None:
+            raise ConnectionError('Rabbit is not connected')
+        await self.queue.bind(self.exchange, routing_key=routing_key)
+        self.bound_keys.add(routing_key)
+
+    @staticmethod
+    def message(data: dict, correlation_id) -> Message:
+        """
+        Message with json body. Big bodies (likes digest) are compressed,
+        it's marked with content_encoding.
+        """
+        body = messages.encode(data)
+        content_encoding = None
+        if 0 < amqp_settings.compress_min_size <= len(body):
+            body = compressor.compress(body)
+            content_encoding = ZSTD
+        return Message(
+            body=body,
+            content_type="application/json",
+            content_encoding=content_encoding,
+            correlation_id=correlation_id,
+            delivery_mode=DeliveryMode.PERSISTENT
+        )
+
+    @staticmethod
+    def decode(message: AbstractIncomingMessage):
+        """
+        Typed payload of consumed message. Body is decompressed if it's
+        compressed, envelope and payload are validated by routing key.
+        """
+        body = message.body
+        if message.content_encoding == ZSTD:
+            body = decompressor.decompress(body)
+        elif message.content_encoding:
+            raise ValueError(f'Unsupported content encoding '
+                             f'{message.content_encoding}')
+        return messages.decode(message.routing_key,  # type: ignore
+                               body)
 
     async def produce(
             self,
@@ -63,88 +208,148 @@ class Rabbit(AbstractQueueInternal):
         :param correlation_id:
         :return:
         """
-        queue = await self.channel.declare_queue(  # type: ignore[union-attr]
-            self.queue_name,
-            durable=True)
-        await queue.bind(self.exchange, routing_key=routing_key)
-
-        message = Message(
-            body=orjson.dumps(data),
-            content_type="application/json",
-            correlation_id=correlation_id,
-            delivery_mode=DeliveryMode.PERSISTENT
-        )
-        await self.exchange.publish(message,  # type: ignore[union-attr]
-                                    routing_key,
-                                    timeout=10)
+        async with self.pool.acquire() as exchange:  # type: ignore
+            await exchange.publish(self.message(data, correlation_id),
+                                   routing_key,
+                                   timeout=10)
         logging.info(f'Published to queue {self.queue_name}. with routing_key'
                      f' {routing_key}.')
 
+    async def produce_many(
+            self,
+            batch: list[tuple[str, dict, str]],
+    ) -> list[str]:
+        """
+        Publish several messages at once. Publishes are pipelined and the
+        whole batch waits for broker confirms.
+        :param batch: routing key, data and correlation_id of messages
+        :return: correlation_ids of confirmed messages
+        """
+        async with self.pool.acquire() as exchange:  # type: ignore
+            results = await asyncio.gather(
+                *(exchange.publish(self.message(data, correlation_id),
+                                   routing_key,
+                                   timeout=10)
+                  for routing_key, data, correlation_id in batch),
+                return_exceptions=True)
+
+        confirmed = []
+        for (routing_key, _, correlation_id), result in zip(batch, results):
+            if isinstance(result, BaseException):
+                logging.error(f'Message {correlation_id} with routing_key '
+                              f'{routing_key} was not confirmed: '
+                              f'{result!r}')
+            else:
+                confirmed.append(correlation_id)
+        logging.info(f'Published {len(confirmed)} of {len(batch)} '
+                     f'messages to queue {self.queue_name}.')
+        return confirmed
+
     async def consume(
             self,
             routing_key: str,
     ):
         """
-        Send data to queue according to routing key
+        Receive messages with routing key from the queue
         :param routing_key:
         :return:
         """
+        await self.bind(routing_key)
+        if self.consumer_channel:
+            return
 
-        # Creating channel
-        self.channel = \
-            await self.connection.channel()  # type: ignore[union-attr]
+        # Consumer has its own channel, so publishing doesn't wait for
+        # deliveries
+        if self.connection is None or self.queue_name is None:
+            raise ConnectionError('Rabbit is not connected')
+        self.consumer_channel = channel = await self.connection.channel()
+        # Broker won't push more than prefetch_count unacked messages
+        if self.prefetch_count:
+            await channel.set_qos(prefetch_count=self.prefetch_count)
+        self.queue = await channel.get_queue(self.queue_name)
 
-        self.exchange = await self.channel.declare_exchange(
-            self.topic_name,
-            ExchangeType.TOPIC
-        )
+    async def iterate(self, concurrency: int = 1):
+        """
+        Consume messages from queue until `stop` is called. Up to
+        `concurrency` messages are processed at the same time, every message
+        is acked only after its processing is finished.
+        :param concurrency: max amount of in-flight messages
+        :return:
+        """
+        if self.connection is None or self.queue is None:
+            raise ConnectionError('Rabbit is not connected')
+        connection, queue = self.connection, self.queue
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks: set[asyncio.Task] = set()
 
-        # Declaring queue
-        self.queue = await self.channel.declare_queue(
-            self.queue_name,
-            durable=True)
-        await self.queue.bind(self.exchange, routing_key=routing_key)
+        async def on_message(message: AbstractIncomingMessage) -> None:
+            task = asyncio.current_task()
+            tasks.add(task)  # type: ignore[arg-type]
+            try:
+                async with semaphore:
+                    if self.stop_event.is_set():
+                        # Processing hasn't started - return message to queue
+                        await message.nack(requeue=True)
+                        return
+                    await self.process(message)
+            except Exception as err:
+                logging.error(f'Message processing failed: {err!r}')
+            finally:
+                tasks.discard(task)  # type: ignore[arg-type]
+
+        async with connection:
+            consumer_tag = await queue.consume(on_message)
+            logging.info(f'Listening queue {self.queue_name} ...')
+            await self.stop_event.wait()
+
+            await queue.cancel(consumer_tag)
+            # Let in-flight messages finish and ack before closing
+            if tasks:
+                logging.info(f'Waiting for {len(tasks)} in-flight '
+                             f'messages...')
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self) -> None:
+        """
+        Stop consuming. Messages that are already being processed are
+        finished and acked, the rest are requeued. `iterate` returns after
+        that.
+        :return:
+        """
+        logging.info(f'Stopping consumer of queue {self.queue_name}...')
+        self.stop_event.set()
+
+    @classmethod
+    async def process(cls, message: AbstractIncomingMessage) -> None:
+        """
+        Process single message. Message is acked after successful processing
+        and rejected if exception was raised.
+        :param message:
+        :return:
+        """
+        async with message.process():
+            payload = cls.decode(message)
+            correlation_id = str(message.correlation_id)
+            # Update notification status in DB after consuming message
+            try:
+                await consumed_status.add(correlation_id)
+            except SQLAlchemyError as err:
+                raise db_bad_request(err)
 
-    async def iterate(self):
-        db = await get_db()
-        conn = DbHelpers(db)
-        async with self.connection:
-            async with self.queue.iterator() as queue_iter:
-                logging.info(f'Listening queue {self.queue_name} ...')
-                async for message in queue_iter:
-                    async with message.process():
-                        body = orjson.loads(message.body)
-                        correlation_id = str(message.correlation_id)
-                        # Update notification status in DB after consuming
-                        # message
-                        try:
-                            await conn.update(
-                                model=Notification,
-                                model_column=Notification.content_id,
-                                column_value=correlation_id,
-                                update_values={
-                                    'status': 'Consumed',
-                                    'failures': 0,
-                                    'modified': datetime.utcnow()})
-                        except SQLAlchemyError as err:
-                            raise db_bad_request(err)
-
-                        logging.info(f'Message arrived to queue:\n{body}\n'
-                                     f'Trying to send an email.')
-                        if message.routing_key == \
-                                'user-reporting.v1.registered':
-                            await Email().send_registered(body,
-                                                          correlation_id)
-                        elif message.routing_key == \
-                                'user-reporting.v1.likes-for-reviews':
-                            await Email().send_likes(body,
-                                                     correlation_id)
-                        logging.info(f'Message with routing-key '
-                                     f'{message.routing_key} has been '
-                                     f'processed.')
+            logging.info(f'Message arrived to queue:\n{payload}\n'
+                         f'Trying to send an email.')
+            await route(message.routing_key,  # type: ignore
+                        payload,
+                        correlation_id)
+            logging.info(f'Message with routing-key {message.routing_key} '
+                         f'has been processed.')
 
     async def close(self):
         logging.info('Closing all connections to rabbit...')
+        if self.pool:
+            await self.pool.close()
+        if self.consumer_channel:
+            await self.consumer_channel.close()
         if self.channel:
             await self.channel.close()
         if self.connection:
@@ -21,4 +21,4 @@ cd src && alembic upgrade head
 cd ..
 pwd
 gunicorn -k uvicorn.workers.UvicornWorker --chdir src main:app --bind 0.0.0.0:8000 &
-python src/consume.py
\ No newline at end of file
+exec python src/supervisor.py
\ No newline at end of file
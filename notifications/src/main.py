@@ -9,9 +9,13 @@ from fastapi import FastAPI, Request, status
 from fastapi.responses import ORJSONResponse
 
 from api.v1 import notify_email
-from core.config import settings, amqp_settings, db_settings
+from core.config import settings, amqp_settings, db_settings, \
+    history_settings, outbox_settings
 from core.logger import LOGGING
 from db import rabbit as amqp, scheduler, postgres as db
+from message_worker import templates, transport as email
+from message_worker.router import ROUTING_KEYS
+from services import history, http_client as http, outbox
 from tasks import jobs
 
 
@@ -22,11 +26,35 @@ async def startup():
         f'{db_settings.user}:{db_settings.password}@'
         f'{db_settings.host}:{db_settings.port}/'
         f'{db_settings.dbname}')
+    db.postgres.start_metrics(db_settings.pool_metrics_interval)
 
     # Connecting to AMQP
     amqp.rabbit = amqp.Rabbit()
     await amqp.rabbit.connect(amqp_settings.get_amqp_uri(),
-                              queue_name='email_worker')
+                              queue_name='email_worker',
+                              routing_keys=ROUTING_KEYS)
+
+    # Email delivery transport
+    email.transport = email.create_transport()
+
+    # Email templates compiled once
+    templates.templates = templates.create_template_registry()
+    await templates.templates.register()
+
+    # Shared HTTP client
+    http.http_client = http.create_http_client()
+
+    # Buffered notifications history
+    history.history_writer = history.HistoryWriter(
+        size=history_settings.batch_size,
+        interval=history_settings.flush_interval,
+        max_rows=history_settings.max_rows)
+
+    # Publishing notifications written to the outbox
+    outbox.outbox_relay = outbox.OutboxRelay(
+        batch_size=outbox_settings.batch_size,
+        interval=outbox_settings.poll_interval)
+    outbox.outbox_relay.start()
 
     # Connecting to scheduler
     job = await scheduler.get_scheduler()
@@ -36,10 +64,18 @@ async def startup():
 
 
 async def shutdown():
+    if outbox.outbox_relay:
+        await outbox.outbox_relay.close()
+    if history.history_writer:
+        await history.history_writer.close()
     if amqp.rabbit:
         await amqp.rabbit.close()
     if db.postgres:
         await db.postgres.close()
+    if email.transport:
+        await email.transport.close()
+    if http.http_client:
+        await http.http_client.close()
 
 
 @asynccontextmanager  # type: ignore[arg-type]
@@ -2,11 +2,31 @@ import logging
 from abc import ABC, abstractmethod
 from datetime import datetime
 
+from sqlalchemy import bindparam, case, select
 from sqlalchemy.exc import SQLAlchemyError
 
-from models.schemas import Notification, NotificationsHistory
-from services.connections import get_db, DbHelpers
+from core.config import email_settings
+from db.postgres import db_session
+from models.messages import LikesForReviews, UserLikesForReviews, \
+    UserRegistered
+from models.schemas import Notification, NotificationContent
+from services.connections import DbHelpers, BulkUpdater
 from services.exceptions import db_bad_request
+from services.history import get_history_writer
+
+
+# Concurrently sent messages are moved to `Sent` with one UPDATE
+sent_status = BulkUpdater(
+    model=Notification,
+    model_column=Notification.content_id,
+    update_values=lambda: {'status': 'Sent',
+                           'failures': 0,
+                           'modified': datetime.utcnow(),
+                           'last_notification_send': datetime.utcnow()})
+
+# Idempotency check runs for every message
+notification_status = select(Notification.status).where(
+    Notification.content_id == bindparam('content_id'))
 
 
 class AbstractMessage(ABC):
@@ -17,16 +37,22 @@ class AbstractMessage(ABC):
 
     @abstractmethod
     async def send_registered(self,
-                              data: dict,
+                              data: UserRegistered,
                               correlation_id: str):
         pass
 
     @abstractmethod
     async def send_likes(self,
-                         data: dict,
+                         data: LikesForReviews,
                          correlation_id: str):
         pass
 
+    @abstractmethod
+    async def send_user_likes(self,
+                              data: UserLikesForReviews,
+                              correlation_id: str):
+        pass
+
     @staticmethod
     async def message_already_sent(correlation_id: str) -> bool | None:
         """
@@ -35,14 +61,11 @@ class AbstractMessage(ABC):
         :param correlation_id:
         :return:
         """
-        db = await get_db()
-        conn = DbHelpers(db)
         try:
-            message = await conn.select(
-                model=Notification,
-                filter_=Notification.content_id == correlation_id)
-            message = message.scalar_one()
-            if message.status == 'Sent':
+            async with db_session() as db:
+                status = await DbHelpers(db).execute(
+                    notification_status, {'content_id': correlation_id})
+            if status.scalar_one() == 'Sent':
                 return True
             return None
         except SQLAlchemyError as err:
@@ -50,40 +73,58 @@ class AbstractMessage(ABC):
 
     @staticmethod
     async def change_db_status(correlation_id: str):
-        db = await get_db()
-        conn = DbHelpers(db)
         try:
-            await conn.update(
-                model=Notification,
-                model_column=Notification.content_id,
-                column_value=correlation_id,
-                update_values={
-                    'status': 'Sent',
-                    'failures': 0,
-                    'modified': datetime.utcnow(),
-                    'last_notification_send': datetime.utcnow()})
+            await sent_status.add(correlation_id)
         except SQLAlchemyError as err:
             raise db_bad_request(err)
 
+    @staticmethod
+    async def keep_undelivered(correlation_id: str, data: dict) -> None:
+        """
+        Message was delivered partially. Only undelivered part stays in the
+        content, so retry won't send emails twice. Notification stays in
+        `Consumed` status and is retried until it fails
+        `max_delivery_failures` times, then it's moved to `Failed`.
+        :param correlation_id:
+        :param data: undelivered part of the message
+        :return:
+        """
+        async with db_session() as db:
+            conn = DbHelpers(db)
+            try:
+                await conn.update(
+                    model=NotificationContent,
+                    model_column=NotificationContent.id,
+                    column_value=correlation_id,
+                    update_values={'content': data})
+                await conn.update(
+                    model=Notification,
+                    model_column=Notification.content_id,
+                    column_value=correlation_id,
+                    update_values={
+                        'failures': Notification.failures + 1,
+                        'status': case(
+                            (Notification.failures + 1 >=
+                             email_settings.max_delivery_failures,
+                             'Failed'),
+                            else_=Notification.status),
+                        'modified': datetime.utcnow()})
+            except SQLAlchemyError as err:
+                raise db_bad_request(err)
+
     @staticmethod
     async def add_notifications_history(user_id: str,
                                         user_email: str,
                                         message_content: dict,
-                                        html_content: str = '') -> None:
-        db = await get_db()
-        conn = DbHelpers(db)
-        try:
-            await conn.insert(
-                NotificationsHistory(user_id,
-                                     user_email,
-                                     str(message_content),
-                                     html_content,
-                                     datetime.utcnow()
-                                     )
-            )
-
-        except SQLAlchemyError as err:
-            raise db_bad_request(err)
+                                        template_hash: str) -> None:
+        # History is buffered and written in batches. Html isn't stored,
+        # it is rendered from message content and template version on demand
+        await get_history_writer().add({
+            'user_id': user_id,
+            'user_email': user_email,
+            'message_content': message_content,
+            'template_hash': template_hash,
+            'last_notification_send': datetime.utcnow()})
 
     @staticmethod
     def id_exists_error(correlation_id: str):
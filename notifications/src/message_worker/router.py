@@ -0,0 +1,101 @@
+import logging
+from typing import Any, Awaitable, Callable
+
+from core.config import digest_settings
+from message_worker.send_emails import Email
+from db.postgres import db_session
+from models.messages import LIKES_FOR_REVIEWS, REGISTERED, \
+    USER_LIKES_FOR_REVIEWS, LikesForReviews, UserLikesForReviews, \
+    UserRegistered
+from services.connections import DbHelpers
+from services.helpers import initiate_missing_notifications_helper
+
+# Bound to email worker queue
+ROUTING_KEYS = (REGISTERED, LIKES_FOR_REVIEWS, USER_LIKES_FOR_REVIEWS)
+
+
+def chunk_id(digest_id: str, number: int) -> str:
+    return f'{digest_id}:{number}'
+
+
+def digest_of(chunk_id_: str) -> str:
+    """
+    Digest id of the chunk. Correlation id that isn't built by `chunk_id`
+    (legacy or user initiated notification) is a digest of its own.
+    """
+    if ':' not in chunk_id_:
+        return chunk_id_
+    digest_id, _ = chunk_id_.rsplit(':', 1)
+    return digest_id
+
+
+async def fan_out_likes(data: LikesForReviews, correlation_id: str) -> None:
+    """
+    Split likes for reviews chunk into messages for every user. Correlation
+    id of user message is built from digest id and user id, so redelivered
+    chunk or the same user in another chunk of the digest doesn't produce
+    user messages twice.
+    :param data: likes for reviews chunk
+    :param correlation_id: chunk correlation id
+    :return:
+    """
+    digest_id = digest_of(correlation_id)
+    messages = {}
+    for user_id, likes in data.items():
+        email, first_name, last_name = likes[-1]
+        messages[f'{digest_id}:{user_id}'] = {
+            'id': user_id,
+            'email': email,
+            'first_name': first_name,
+            'last_name': last_name,
+            'reviews': likes[:-1]}
+
+    async with db_session() as db:
+        await initiate_missing_notifications_helper(DbHelpers(db),
+                                                    USER_LIKES_FOR_REVIEWS,
+                                                    messages)
+    # Chunk itself is done, every user is tracked by own notification
+    await Email().change_db_status(correlation_id)
+    logging.info(f'Likes for reviews {correlation_id} has been split into '
+                 f'{len(messages)} messages.')
+
+
+async def registered(data: UserRegistered, correlation_id: str) -> None:
+    await Email().send_registered(data, correlation_id)
+
+
+async def likes_for_reviews(data: LikesForReviews,
+                            correlation_id: str) -> None:
+    if digest_settings.fan_out:
+        await fan_out_likes(data, correlation_id)
+    else:
+        await Email().send_likes(data, correlation_id)
+
+
+async def user_likes_for_reviews(data: UserLikesForReviews,
+                                 correlation_id: str) -> None:
+    await Email().send_user_likes(data, correlation_id)
+
+
+# Handler of every routing key, payload type is in models.messages
+HANDLERS: dict[str, Callable[[Any, str], Awaitable[None]]] = {
+    REGISTERED: registered,
+    LIKES_FOR_REVIEWS: likes_for_reviews,
+    USER_LIKES_FOR_REVIEWS: user_likes_for_reviews,
+}
+
+
+async def route(routing_key: str, payload, correlation_id: str) -> None:
+    """
+    Send notification according to its routing key
+    :param routing_key:
+    :param payload: typed message content
+    :param correlation_id:
+    :return:
+    """
+    handler = HANDLERS.get(routing_key)
+    if handler is None:
+        logging.error(f'Unknown routing key {routing_key} of message '
+                      f'{correlation_id}.')
+        return
+    await handler(payload, correlation_id)
@@ -1,82 +1,200 @@
 import logging
-import os
 
-from jinja2 import Environment, FileSystemLoader
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
+from sendgrid.helpers.mail import Mail, Personalization, Substitution, To
 
 from core.config import email_settings
 from message_worker import AbstractMessage
+from models.messages import LikesForReviews, UserLikesForReviews, \
+    UserRegistered
+from message_worker.templates import SplitTemplate, TemplateRegistry, \
+    get_template_registry
+from message_worker.transport import AbstractTransport, DeliveryError, \
+    get_transport
+
+# SendGrid personalization substitutions can't exceed 10000 bytes
+SUBSTITUTIONS_LIMIT = 10000
+REGISTERED_TEMPLATE = 'email_registered.html'
+LIKES_TEMPLATE = 'email_likes_for_review.html'
 
 
 class Email(AbstractMessage):
-    current_path = os.path.dirname(__file__)
-    loader = FileSystemLoader(current_path)
-    env = Environment(loader=loader)
+    def __init__(self,
+                 transport: AbstractTransport | None = None,
+                 templates: TemplateRegistry | None = None) -> None:
+        self.transport = transport or get_transport()
+        self.templates = templates or get_template_registry()
 
-    async def send_registered(self, data: dict, correlation_id: str):
+    async def send_registered(self,
+                              data: UserRegistered,
+                              correlation_id: str):
         sent = await self.message_already_sent(correlation_id)
         if sent:
             return self.id_exists_error(correlation_id)
 
-        template = self.env.get_template('email_templates/'
-                                         'email_registered.html')
         template_data = {
-            "first_name": data['first_name'],
-            "last_name": data['last_name']
+            "first_name": data.first_name,
+            "last_name": data.last_name
         }
-        output = template.render(**template_data)
+        output = await self.templates.render(REGISTERED_TEMPLATE,
+                                             **template_data)
+        template_hash = await self.templates.version(REGISTERED_TEMPLATE)
 
         message = Mail(
             from_email=email_settings.from_email,
-            to_emails=data['email'],
+            to_emails=data.email,
             subject='User registration confirmation',
             html_content=output)
         try:
-            sg = SendGridAPIClient(email_settings.sg_api_key)
-            response = sg.send(message)
+            response = await self.transport.send(message)
+            logging.info(f'Sendgrid status code: {response.status_code}')
+            logging.info(f'Sendgrid message body: {response.body}')
+            logging.info(f'Sendgrid headers:\n {response.headers}')
+            await self.change_db_status(correlation_id)
+            await self.add_notifications_history(data.id,
+                                                 data.email,
+                                                 template_data,
+                                                 template_hash)
+        except Exception as e:
+            logging.error(e)
+
+    async def send_user_likes(self,
+                              data: UserLikesForReviews,
+                              correlation_id: str):
+        """
+        Send digest to one user, message is produced by likes fan-out.
+        """
+        sent = await self.message_already_sent(correlation_id)
+        if sent:
+            return self.id_exists_error(correlation_id)
+
+        template_data = {
+            "first_name": data.first_name,
+            "last_name": data.last_name,
+            "reviews": data.reviews
+        }
+        output = await self.templates.render(LIKES_TEMPLATE, **template_data)
+        template_hash = await self.templates.version(LIKES_TEMPLATE)
+
+        message = Mail(
+            from_email=email_settings.from_email,
+            to_emails=data.email,
+            subject='Your best comments today! ',
+            html_content=output)
+        try:
+            response = await self.transport.send(message)
             logging.info(f'Sendgrid status code: {response.status_code}')
             logging.info(f'Sendgrid message body: {response.body}')
             logging.info(f'Sendgrid headers:\n {response.headers}')
             await self.change_db_status(correlation_id)
-            await self.add_notifications_history(data['id'],
-                                                 data['email'],
+            await self.add_notifications_history(data.id,
+                                                 data.email,
                                                  template_data,
-                                                 output)
+                                                 template_hash)
         except Exception as e:
             logging.error(e)
 
-    async def send_likes(self, data: dict, correlation_id: str):
+    async def send_likes(self,
+                         data: LikesForReviews,
+                         correlation_id: str):
+        """
+        Send digest to all users from data. Users are grouped into batches,
+        every batch is sent with one request that has personalization for
+        every user. Static part of the template is rendered once, only slot
+        values are rendered for every user.
+        """
         sent = await self.message_already_sent(correlation_id)
         if sent:
             return self.id_exists_error(correlation_id)
 
-        template = self.env.get_template('email_templates/'
-                                         'email_likes_for_review.html')
+        split = self.templates.split(LIKES_TEMPLATE)
+        template_hash = await self.templates.version(LIKES_TEMPLATE)
+        small: list[tuple[str, str, dict, dict]] = []
+        large: list[tuple[str, str, dict, dict]] = []
         for user_id in data:
             to_email = data[user_id][-1][0]
             template_data = {
                 "first_name": data[user_id][-1][1],
-                "last_name": data[user_id][-1][1],
+                "last_name": data[user_id][-1][2],
                 "reviews": data[user_id][:-1]
             }
-            output = template.render(**template_data)
+            slots = self.templates.render_slots(LIKES_TEMPLATE,
+                                                **template_data)
+            recipient = (user_id, to_email, template_data, slots)
+            # Substitutions of every personalization are limited by
+            # SendGrid, such emails are sent one by one
+            size = sum(len(tag) + len(value.encode())
+                       for tag, value in slots.items())
+            if size <= SUBSTITUTIONS_LIMIT:
+                small.append(recipient)
+            else:
+                large.append(recipient)
+        size = email_settings.sg_batch_size
+        batches = [small[i:i + size] for i in range(0, len(small), size)]
+        batches += [[recipient] for recipient in large]
 
-            message = Mail(
-                from_email=email_settings.from_email,
-                to_emails=to_email,
-                subject='Your best comments today! ',
-                html_content=output)
+        undelivered = {}
+        for number, batch in enumerate(batches):
+            delivered = False
             try:
-                sg = SendGridAPIClient(email_settings.sg_api_key)
-                response = sg.send(message)
+                response = await self.transport.send(
+                    self.batch_message(batch,
+                                       'Your best comments today! ',
+                                       split))
+                delivered = True
                 logging.info(f'Sendgrid status code: {response.status_code}')
                 logging.info(f'Sendgrid message body: {response.body}')
                 logging.info(f'Sendgrid headers:\n {response.headers}')
-                await self.change_db_status(correlation_id)
-                await self.add_notifications_history(user_id,
-                                                     to_email,
-                                                     template_data,
-                                                     output)
-            except Exception as e:
-                logging.error(e)
+                for user_id, to_email, template_data, _ in batch:
+                    await self.add_notifications_history(user_id,
+                                                         to_email,
+                                                         template_data,
+                                                         template_hash)
+            except DeliveryError as e:
+                logging.error(f'Batch of {len(batch)} emails for '
+                              f'{correlation_id} has not been delivered: {e}')
+                for user_id, *_ in batch:
+                    undelivered[user_id] = data[user_id]
+            except Exception:
+                # Delivered batches aren't sent again on retry
+                rest = batches[number + 1:] if delivered else batches[number:]
+                for pending in rest:
+                    for user_id, *_ in pending:
+                        undelivered[user_id] = data[user_id]
+                await self.finish_batches(correlation_id, undelivered)
+                raise
+        await self.finish_batches(correlation_id, undelivered)
+
+    async def finish_batches(self,
+                             correlation_id: str,
+                             undelivered: dict) -> None:
+        if undelivered:
+            # Only undelivered emails will be sent on retry
+            await self.keep_undelivered(correlation_id, undelivered)
+        else:
+            await self.change_db_status(correlation_id)
+
+    @staticmethod
+    def batch_message(batch: list[tuple[str, str, dict, dict]],
+                      subject: str,
+                      split: SplitTemplate) -> Mail:
+        """
+        One message for several recipients. Html body is the template
+        skeleton, every recipient gets own slot values with substitutions.
+        """
+        if len(batch) == 1:
+            _, to_email, _, slots = batch[0]
+            return Mail(from_email=email_settings.from_email,
+                        to_emails=to_email,
+                        subject=subject,
+                        html_content=split.assemble(slots))
+
+        message = Mail(from_email=email_settings.from_email,
+                       subject=subject,
+                       html_content=split.skeleton)
+        for _, to_email, _, slots in batch:
+            personalization = Personalization()
+            personalization.add_to(To(to_email))
+            for tag, value in slots.items():
+                personalization.add_substitution(Substitution(tag, value))
+            message.add_personalization(personalization)
+        return message
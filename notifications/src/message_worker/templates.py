@@ -0,0 +1,269 @@
+import hashlib
+import logging
+import os
+import re
+import secrets
+import time
+from typing import Callable, Iterator
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, \
+    Template
+from jinja2.runtime import Context
+
+from core.config import email_settings
+from db.postgres import db_session
+from models.schemas import EmailTemplate
+from services.connections import DbHelpers
+
+TEMPLATES_PATH = os.path.join(os.path.dirname(__file__), 'email_templates')
+
+# Templates of mass emails: variables and blocks that differ per recipient
+SPLIT_TEMPLATES = {
+    'email_likes_for_review.html': (('first_name', 'last_name'),
+                                    ('reviews',)),
+}
+
+
+def constant_block(text: str) -> Callable[[Context], Iterator[str]]:
+    """
+    Block render function that outputs the same text for any context
+    """
+    def render(context: Context) -> Iterator[str]:
+        yield text
+    return render
+
+
+class SplitTemplate:
+    """
+    Template split into the skeleton rendered once and per-recipient slots.
+    Skeleton has substitution tag in place of every slot variable and
+    block, so one email body is sent for many recipients and only slot
+    values are rendered for every recipient. Tags have a random part, so
+    they don't occur in template text or in guessed values.
+    """
+
+    def __init__(self,
+                 template: Template,
+                 variables: tuple[str, ...],
+                 blocks: tuple[str, ...]) -> None:
+        self.template = template
+        self.variables = variables
+        self.blocks = blocks
+        self.nonce = secrets.token_hex(8)
+        self.pattern = re.compile('|'.join(
+            re.escape(self.tag(name)) for name in variables + blocks))
+        # Template globals are copied once, not for every recipient
+        self.globals = dict(template.globals)
+
+        context = template.new_context(
+            {name: self.tag(name) for name in variables})
+        for name in blocks:
+            context.blocks[name] = [constant_block(self.tag(name))]
+        self.skeleton = ''.join(template.root_render_func(context))
+
+    def tag(self, name: str) -> str:
+        return f'-{name}-{self.nonce}-'
+
+    def slots(self, **context) -> dict[str, str]:
+        """
+        Slot values of one recipient by substitution tag
+        """
+        values = {self.tag(name): str(context[name])
+                  for name in self.variables}
+        if self.blocks:
+            block_context = self.template.new_context(
+                {**self.globals, **context}, shared=True)
+            for name in self.blocks:
+                values[self.tag(name)] = ''.join(
+                    self.template.blocks[name](block_context))
+        return values
+
+    def assemble(self, slots: dict[str, str]) -> str:
+        """
+        Full html of one recipient. Tags are replaced in one pass, so tags in
+        slot values are kept as they are.
+        """
+        return self.pattern.sub(lambda match: slots[match.group()],
+                                self.skeleton)
+
+
+class TemplateRegistry:
+    """
+    Email templates compiled once at startup. Compiled code is kept in the
+    bytecode cache on disk, so restarted workers don't compile templates
+    again. Without auto reload templates are taken from memory and files are
+    never checked for changes. Render time of every template is recorded.
+    Every version of a template is identified by the hash of its source and
+    stored in DB, so html of sent emails can be rendered again later.
+    """
+
+    def __init__(self,
+                 path: str,
+                 cache_dir: str | None = None,
+                 auto_reload: bool = False,
+                 enable_async: bool = False) -> None:
+        self.auto_reload = auto_reload
+        self.enable_async = enable_async
+        # Async templates compile to different code, cache them separately
+        mode = 'async' if enable_async else 'sync'
+        self.env = Environment(
+            loader=FileSystemLoader(path),
+            bytecode_cache=FileSystemBytecodeCache(
+                cache_dir, pattern=f'__jinja2_{mode}_%s.cache'),
+            auto_reload=auto_reload,
+            enable_async=enable_async)
+        # Split templates are rendered synchronously
+        self.sync_env = self.env.overlay(
+            bytecode_cache=FileSystemBytecodeCache(
+                cache_dir, pattern='__jinja2_sync_%s.cache'),
+            enable_async=False) if enable_async else self.env
+        self.templates: dict[str, Template] = {}
+        self.split_templates: dict[str, SplitTemplate] = {}
+        # Template versions by source hash, old versions are loaded from DB
+        self.versions: dict[str, Template] = {}
+        self.hashes: dict[str, str] = {}
+        # Versions that are stored in DB
+        self.registered: set[str] = set()
+        # Template name: renders, total and max render time in seconds
+        self.timings: dict[str, list] = {}
+
+    def load(self) -> None:
+        for name in self.env.list_templates(extensions=['html']):
+            self.templates[name] = self.env.get_template(name)
+            self.versions[self.hash(name)] = self.templates[name]
+        for name in SPLIT_TEMPLATES:
+            self.split(name)
+        logging.info(f'Email templates are loaded: {list(self.templates)}')
+
+    def get(self, name: str) -> Template:
+        if self.auto_reload or name not in self.templates:
+            self.templates[name] = self.env.get_template(name)
+        return self.templates[name]
+
+    def source(self, name: str) -> str:
+        source, _, _ = self.env.loader.get_source(  # type: ignore
+            self.env, name)
+        return source
+
+    @staticmethod
+    def digest(source: str) -> str:
+        return hashlib.sha256(source.encode()).hexdigest()
+
+    def hash(self, name: str) -> str:
+        if self.auto_reload or name not in self.hashes:
+            self.hashes[name] = self.digest(self.source(name))
+        return self.hashes[name]
+
+    async def register(self, *names: str) -> list[str]:
+        """
+        Store versions of templates that aren't in DB yet
+        :param names: all loaded templates by default
+        :return: hashes of stored versions
+        """
+        rows = []
+        for name in names or self.templates:
+            source = self.source(name)
+            rows.append({'hash': self.digest(source),
+                         'name': name,
+                         'source': source})
+        async with db_session() as db:
+            await DbHelpers(db).insert_missing(EmailTemplate, rows)
+        hashes = [row['hash'] for row in rows]
+        self.registered.update(hashes)
+        return hashes
+
+    async def version(self, name: str) -> str:
+        """
+        Hash of the current version of template. Version changed by auto
+        reload is stored before emails refer to it.
+        """
+        hash_ = self.hash(name)
+        if hash_ not in self.registered:
+            hash_, = await self.register(name)
+        return hash_
+
+    async def render_version(self, hash_: str, context: dict) -> str:
+        """
+        Render template version that was used for an email
+        :param hash_: hash of template source
+        :param context: template data stored with the email
+        :return:
+        """
+        if hash_ not in self.versions:
+            async with db_session() as db:
+                res = await DbHelpers(db).select(
+                    EmailTemplate,
+                    EmailTemplate.hash == hash_,
+                    columns=(EmailTemplate.source,))
+            source = res.scalar_one_or_none()
+            if source is None:
+                raise LookupError(f'Template version {hash_} is not found')
+            # Versions never change, compiled template is kept
+            self.versions[hash_] = self.env.from_string(source)
+        template = self.versions[hash_]
+        started = time.perf_counter()
+        if self.enable_async:
+            output = await template.render_async(**context)
+        else:
+            output = template.render(**context)
+        self.record(f'{hash_}:version', time.perf_counter() - started)
+        return output
+
+    def split(self, name: str) -> SplitTemplate:
+        if self.auto_reload or name not in self.split_templates:
+            variables, blocks = SPLIT_TEMPLATES[name]
+            self.split_templates[name] = SplitTemplate(
+                self.sync_env.get_template(name), variables, blocks)
+        return self.split_templates[name]
+
+    def render_slots(self, name: str, **context) -> dict[str, str]:
+        """
+        Slot values of split template for one recipient
+        """
+        split = self.split(name)
+        started = time.perf_counter()
+        slots = split.slots(**context)
+        self.record(f'{name}:slots', time.perf_counter() - started)
+        return slots
+
+    async def render(self, name: str, **context) -> str:
+        template = self.get(name)
+        started = time.perf_counter()
+        if self.enable_async:
+            output = await template.render_async(**context)
+        else:
+            output = template.render(**context)
+        self.record(name, time.perf_counter() - started)
+        return output
+
+    def record(self, name: str, elapsed: float) -> None:
+        timing = self.timings.setdefault(name, [0, 0.0, 0.0])
+        timing[0] += 1
+        timing[1] += elapsed
+        timing[2] = max(timing[2], elapsed)
+
+    def render_timings(self) -> dict[str, dict]:
+        return {name: {'renders': count,
+                       'avg': total / count,
+                       'max': max_}
+                for name, (count, total, max_) in self.timings.items()}
+
+
+templates: TemplateRegistry | None = None
+
+
+def create_template_registry() -> TemplateRegistry:
+    registry = TemplateRegistry(
+        path=TEMPLATES_PATH,
+        cache_dir=email_settings.template_cache_dir,
+        auto_reload=email_settings.template_auto_reload,
+        enable_async=email_settings.template_async)
+    registry.load()
+    return registry
+
+
+def get_template_registry() -> TemplateRegistry:
+    global templates
+    if templates is None:
+        templates = create_template_registry()
+    return templates
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+
+import aiohttp
+import orjson
+from sendgrid.helpers.mail import Mail
+
+from core.config import email_settings
+
+
+class DeliveryError(Exception):
+    """
+    Email provider didn't accept the message.
+    status_code is 0 if provider hasn't responded at all.
+    """
+
+    def __init__(self, status_code: int, body: str) -> None:
+        super().__init__(f'Delivery failed with status {status_code}: '
+                         f'{body}')
+        self.status_code = status_code
+        self.body = body
+
+
+class TransportResponse:
+    def __init__(self,
+                 status_code: int,
+                 body: str,
+                 headers: dict) -> None:
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers
+
+
+class AbstractTransport(ABC):
+    """
+    Абстрактный класс для доставки писем.
+    Описывает какие методы должны быть у подобных классов.
+    """
+
+    @abstractmethod
+    async def send(self, message: Mail) -> TransportResponse:
+        """
+        Deliver message. Raises DeliveryError if message wasn't accepted.
+        """
+        ...
+
+    @abstractmethod
+    async def close(self) -> None:
+        ...
+
+
+class SendGridTransport(AbstractTransport):
+    """
+    Sends messages to SendGrid v3 API with long-lived HTTP session, so
+    connections are reused between messages.
+    """
+
+    def __init__(self,
+                 api_key: str,
+                 url: str,
+                 timeout: float,
+                 pool_size: int,
+                 keepalive_timeout: float) -> None:
+        self.url = url
+        connector = aiohttp.TCPConnector(limit=pool_size,
+                                         keepalive_timeout=keepalive_timeout)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            headers={'Authorization': f'Bearer {api_key}'},
+            timeout=aiohttp.ClientTimeout(total=timeout),
+            json_serialize=lambda obj: orjson.dumps(obj).decode())
+
+    async def send(self, message: Mail) -> TransportResponse:
+        try:
+            async with self.session.post(self.url,
+                                         json=message.get()) as response:
+                body = await response.text()
+                if response.status >= 400:
+                    raise DeliveryError(response.status, body)
+                return TransportResponse(response.status,
+                                         body,
+                                         dict(response.headers))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            raise DeliveryError(0, repr(err)) from err
+
+    async def close(self) -> None:
+        await self.session.close()
+
+
+class FakeTransport(AbstractTransport):
+    """
+    Keeps messages in memory instead of sending them. For tests and
+    benchmarks.
+    """
+
+    def __init__(self, latency: float = 0, status_code: int = 202) -> None:
+        self.latency = latency
+        self.status_code = status_code
+        self.sent: list[dict] = []
+
+    async def send(self, message: Mail) -> TransportResponse:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.status_code >= 400:
+            raise DeliveryError(self.status_code, 'Fake transport error')
+        self.sent.append(message.get())
+        return TransportResponse(self.status_code, '', {})
+
+    async def close(self) -> None:
+        self.sent.clear()
+
+
+transport: AbstractTransport | None = None
+
+
+def create_transport() -> AbstractTransport:
+    if email_settings.transport == 'fake':
+        logging.warning('Fake email transport is used. Emails will not be '
+                        'delivered.')
+        return FakeTransport(latency=email_settings.fake_latency)
+    return SendGridTransport(
+        api_key=email_settings.sg_api_key,
+        url=email_settings.sg_api_url,
+        timeout=email_settings.sg_timeout,
+        pool_size=email_settings.sg_pool_size,
+        keepalive_timeout=email_settings.sg_keepalive_timeout)
+
+
+def get_transport() -> AbstractTransport:
+    global transport
+    if transport is None:
+        transport = create_transport()
+    return transport
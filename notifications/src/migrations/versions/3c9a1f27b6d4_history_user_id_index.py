@@ -0,0 +1,27 @@
+"""history user_id index
+
+Revision ID: 3c9a1f27b6d4
+Revises: fe6f400a5170
+Create Date: 2026-10-18 12:10:41.532817
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '3c9a1f27b6d4'
+down_revision: Union[str, None] = 'fe6f400a5170'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_notifications_history_user_id_send_id',
+                    'notifications_history',
+                    ['user_id', 'last_notification_send', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_notifications_history_user_id_send_id',
+                  table_name='notifications_history')
@@ -0,0 +1,92 @@
+"""content jsonb
+
+Revision ID: 8e5d2b0c4a91
+Revises: 3c9a1f27b6d4
+Create Date: 2026-10-18 13:02:17.204511
+
+"""
+import ast
+import logging
+from typing import Sequence, Union
+
+import orjson
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects.postgresql import JSONB
+
+# revision identifiers, used by Alembic.
+revision: str = '8e5d2b0c4a91'
+down_revision: Union[str, None] = '3c9a1f27b6d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+# (table, column with str() of python object, primary key)
+COLUMNS = (('content', 'content', 'id'),
+           ('notifications_history', 'message_content', 'id'))
+
+
+def default(obj):
+    """
+    Python literals that aren't json types
+    """
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode(errors='replace')
+    raise TypeError
+
+
+def to_json(value: str) -> str:
+    """
+    Content was stored as str() of python object
+    """
+    try:
+        obj = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        try:
+            obj = orjson.loads(value)
+        except orjson.JSONDecodeError:
+            obj = value
+    try:
+        return orjson.dumps(obj,
+                            default=default,
+                            option=orjson.OPT_NON_STR_KEYS).decode()
+    except TypeError as err:
+        logger.warning(f'Content is kept as json string, it can\'t be '
+                       f'converted: {err}\n{value}')
+        return orjson.dumps(value).decode()
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    for table, column, key in COLUMNS:
+        op.add_column(table, sa.Column(f'{column}_jsonb', JSONB))
+        # Rows are paged by primary key, converted rows aren't scanned again
+        first = sa.text(f'SELECT {key}, {column} FROM {table} '
+                        f'WHERE {column} IS NOT NULL '
+                        f'ORDER BY {key} LIMIT {BATCH_SIZE}')
+        select = sa.text(f'SELECT {key}, {column} FROM {table} '
+                         f'WHERE {key} > :last AND {column} IS NOT NULL '
+                         f'ORDER BY {key} LIMIT {BATCH_SIZE}')
+        update = sa.text(f'UPDATE {table} '
+                         f'SET {column}_jsonb = CAST(:value AS jsonb) '
+                         f'WHERE {key} = :key')
+        rows = bind.execute(first).all()
+        while rows:
+            bind.execute(update, [{'key': row[0], 'value': to_json(row[1])}
+                                  for row in rows])
+            rows = bind.execute(select, {'last': rows[-1][0]}).all()
+        op.drop_column(table, column)
+        op.alter_column(table, f'{column}_jsonb', new_column_name=column)
+
+
+def downgrade() -> None:
+    # JSON text is kept, it's not converted back to python literals
+    for table, column, _ in COLUMNS:
+        op.alter_column(table, column,
+                        type_=sa.String,
+                        postgresql_using=f'{column}::text')
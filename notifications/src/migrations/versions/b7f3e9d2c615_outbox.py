@@ -0,0 +1,37 @@
+"""outbox
+
+Revision ID: b7f3e9d2c615
+Revises: 8e5d2b0c4a91
+Create Date: 2026-10-18 17:30:12.804113
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects.postgresql import UUID
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7f3e9d2c615'
+down_revision: Union[str, None] = '8e5d2b0c4a91'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'outbox',
+        sa.Column('id', UUID(as_uuid=True), primary_key=True,
+                  nullable=False),
+        sa.Column('content_id', sa.String,
+                  sa.ForeignKey('content.id', ondelete='CASCADE'),
+                  unique=True, nullable=False),
+        sa.Column('routing_key', sa.String, nullable=False),
+        sa.Column('created_at', sa.DateTime),
+    )
+    op.create_index('ix_outbox_created_at', 'outbox', ['created_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_outbox_created_at', table_name='outbox')
+    op.drop_table('outbox')
@@ -0,0 +1,43 @@
+"""notifications indexes
+
+Revision ID: c4d8a6f1e2b3
+Revises: b7f3e9d2c615
+Create Date: 2026-10-18 17:52:40.119386
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d8a6f1e2b3'
+down_revision: Union[str, None] = 'b7f3e9d2c615'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+NOT_FINISHED = "status IN ('Initiated', 'Produced', 'Consumed')"
+
+
+def upgrade() -> None:
+    # Table is big, build indexes without blocking writes
+    with op.get_context().autocommit_block():
+        op.create_index('ix_notifications_content_id',
+                        'notifications',
+                        ['content_id'],
+                        postgresql_concurrently=True)
+        op.create_index('ix_notifications_status_modified_not_finished',
+                        'notifications',
+                        ['status', 'modified'],
+                        postgresql_where=sa.text(NOT_FINISHED),
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_notifications_status_modified_not_finished',
+                      table_name='notifications',
+                      postgresql_concurrently=True)
+        op.drop_index('ix_notifications_content_id',
+                      table_name='notifications',
+                      postgresql_concurrently=True)
@@ -0,0 +1,96 @@
+"""monthly partitions
+
+Revision ID: d9e1f4a7b3c2
+Revises: c4d8a6f1e2b3
+Create Date: 2026-10-18 18:20:05.640271
+
+"""
+from datetime import date, datetime
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'd9e1f4a7b3c2'
+down_revision: Union[str, None] = 'c4d8a6f1e2b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Partitions created ahead of the current month
+PREMAKE = 2
+
+NOT_FINISHED = "status IN ('Initiated', 'Produced', 'Consumed')"
+
+# Table, partition key, indexes created on the table after copying
+TABLES = (
+    ('notifications', 'created_at', (
+        'CREATE INDEX ix_notifications_content_id '
+        'ON notifications (content_id)',
+        f'CREATE INDEX ix_notifications_status_modified_not_finished '
+        f'ON notifications (status, modified) WHERE {NOT_FINISHED}',
+    )),
+    ('notifications_history', 'last_notification_send', (
+        'CREATE INDEX ix_notifications_history_user_id_send_id '
+        'ON notifications_history (user_id, last_notification_send, id)',
+    )),
+)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def create_constraints(table: str, primary_key: str) -> None:
+    op.execute(f'ALTER TABLE {table} ADD PRIMARY KEY ({primary_key})')
+    if table == 'notifications':
+        op.execute('ALTER TABLE notifications ADD FOREIGN KEY (content_id) '
+                   'REFERENCES content (id) ON DELETE CASCADE')
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    this_month = datetime.utcnow().date().replace(day=1)
+
+    for table, key, indexes in TABLES:
+        # Rows without partition key can't be routed to a partition
+        op.execute(f'UPDATE {table} SET {key} = now() at time zone \'utc\' '
+                   f'WHERE {key} IS NULL')
+        op.execute(f'ALTER TABLE {table} RENAME TO {table}_old')
+        op.execute(f'CREATE TABLE {table} '
+                   f'(LIKE {table}_old INCLUDING DEFAULTS) '
+                   f'PARTITION BY RANGE ({key})')
+        op.execute(f'ALTER TABLE {table} ALTER COLUMN {key} SET NOT NULL')
+
+        oldest = conn.execute(
+            sa.text(f'SELECT min({key}) FROM {table}_old')).scalar()
+        month = oldest.date().replace(day=1) if oldest else this_month
+        while month <= add_months(this_month, PREMAKE):
+            op.execute(f'CREATE TABLE {table}_y{month.year}m{month.month:02d} '
+                       f'PARTITION OF {table} FOR VALUES '
+                       f"FROM ('{month}') TO ('{add_months(month, 1)}')")
+            month = add_months(month, 1)
+
+        op.execute(f'INSERT INTO {table} SELECT * FROM {table}_old')
+        # Old constraints and indexes are dropped with the old table, unique
+        # constraint on id alone is not possible in partitioned table
+        op.execute(f'DROP TABLE {table}_old')
+        create_constraints(table, f'id, {key}')
+        for index in indexes:
+            op.execute(index)
+
+
+def downgrade() -> None:
+    for table, key, indexes in TABLES:
+        op.execute(f'ALTER TABLE {table} RENAME TO {table}_partitioned')
+        op.execute(f'CREATE TABLE {table} '
+                   f'(LIKE {table}_partitioned INCLUDING DEFAULTS)')
+        op.execute(f'INSERT INTO {table} SELECT * FROM {table}_partitioned')
+        # Partitions are dropped with the partitioned table
+        op.execute(f'DROP TABLE {table}_partitioned')
+        op.execute(f'ALTER TABLE {table} ALTER COLUMN {key} DROP NOT NULL')
+        create_constraints(table, 'id')
+        op.execute(f'ALTER TABLE {table} ADD UNIQUE (id)')
+        for index in indexes:
+            op.execute(index)
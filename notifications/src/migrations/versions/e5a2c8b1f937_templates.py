@@ -0,0 +1,37 @@
+"""templates
+
+Revision ID: e5a2c8b1f937
+Revises: d9e1f4a7b3c2
+Create Date: 2026-10-18 19:05:33.417820
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a2c8b1f937'
+down_revision: Union[str, None] = 'd9e1f4a7b3c2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'templates',
+        sa.Column('hash', sa.String, primary_key=True, nullable=False),
+        sa.Column('name', sa.String, nullable=False),
+        sa.Column('source', sa.Text, nullable=False),
+        sa.Column('created_at', sa.DateTime),
+    )
+    # Added to every partition of the history
+    op.add_column('notifications_history',
+                  sa.Column('template_hash', sa.String,
+                            sa.ForeignKey('templates.hash'),
+                            nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('notifications_history', 'template_hash')
+    op.drop_table('templates')
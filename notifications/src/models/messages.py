@@ -0,0 +1,123 @@
+from typing import Any, Generic, TypeVar
+
+import msgspec
+
+REGISTERED = 'user-reporting.v1.registered'
+LIKES_FOR_REVIEWS = 'user-reporting.v1.likes-for-reviews'
+USER_LIKES_FOR_REVIEWS = 'user-reporting.v1.user-likes-for-reviews'
+
+# Version of the envelope written by producers
+ENVELOPE_VERSION = 1
+
+T = TypeVar('T')
+
+# movie_id, movie_title, review text shortened to 20 signs, likes amount.
+# Names of the user in the last element might be null.
+Review = list[str | int | None]
+# user_id: reviews and [user_email, first_name, last_name] as last element
+LikesForReviews = dict[str, list[Review]]
+
+
+class Envelope(msgspec.Struct, Generic[T], kw_only=True):
+    """
+    Body of every AMQP message: version of its format and payload
+    """
+    v: int = ENVELOPE_VERSION
+    data: T
+
+
+class EnvelopeKeys(msgspec.Struct):
+    """
+    Keys that tell envelope from a body published before it, values aren't
+    parsed
+    """
+    v: msgspec.Raw = msgspec.Raw()
+    data: msgspec.Raw = msgspec.Raw()
+
+
+class UserRegistered(msgspec.Struct):
+    """
+    User from auth service, other fields of the user are ignored
+    """
+    id: str
+    email: str
+    first_name: str | None
+    last_name: str | None
+
+
+class UserLikesForReviews(msgspec.Struct):
+    """
+    Likes for reviews of one user, produced by fan-out of the digest
+    """
+    id: str
+    email: str
+    first_name: str | None
+    last_name: str | None
+    reviews: list[Review]
+
+
+# Payload type of every routing key
+PAYLOADS: dict[str, Any] = {
+    REGISTERED: UserRegistered,
+    LIKES_FOR_REVIEWS: LikesForReviews,
+    USER_LIKES_FOR_REVIEWS: UserLikesForReviews,
+}
+
+encoder = msgspec.json.Encoder()
+# Envelope and payload are decoded and validated in one pass over the body
+decoders: dict[str, msgspec.json.Decoder] = {
+    REGISTERED: msgspec.json.Decoder(Envelope[UserRegistered]),
+    LIKES_FOR_REVIEWS: msgspec.json.Decoder(Envelope[LikesForReviews]),
+    USER_LIKES_FOR_REVIEWS: msgspec.json.Decoder(
+        Envelope[UserLikesForReviews]),
+}
+# Bodies published before the envelope was added
+legacy_decoders: dict[str, msgspec.json.Decoder] = {
+    routing_key: msgspec.json.Decoder(payload)
+    for routing_key, payload in PAYLOADS.items()}
+envelope_keys = msgspec.json.Decoder(EnvelopeKeys)
+
+
+def encode(data: dict) -> bytes:
+    """
+    Message body of notification content
+    """
+    return encoder.encode(Envelope(data=data))
+
+
+def payload_type(routing_key: str) -> Any:
+    if routing_key not in PAYLOADS:
+        raise ValueError(f'Unknown routing key {routing_key}')
+    return PAYLOADS[routing_key]
+
+
+def decode(routing_key: str, body: bytes):
+    """
+    Typed payload of message body
+    :param routing_key:
+    :param body: json body
+    :return:
+    """
+    payload_type(routing_key)
+    try:
+        envelope = decoders[routing_key].decode(body)
+    except msgspec.ValidationError:
+        keys = envelope_keys.decode(body)
+        if len(keys.v) or len(keys.data):
+            # Envelope with invalid payload
+            raise
+        return legacy_decoders[routing_key].decode(body)
+    if envelope.v != ENVELOPE_VERSION:
+        raise msgspec.ValidationError(f'Unsupported envelope version '
+                                      f'{envelope.v}')
+    return envelope.data
+
+
+def convert(routing_key: str, content: dict):
+    """
+    Typed payload of notification content stored in DB
+    :param routing_key:
+    :param content:
+    :return:
+    """
+    return msgspec.convert(content, payload_type(routing_key))
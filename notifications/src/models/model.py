@@ -24,6 +24,12 @@ class PaginateModel:
                  page_size: int = Query(10,
                                         ge=1,
                                         le=50),
+                 cursor: str | None = Query(
+                     None,
+                     description='Value of X-Next-Cursor header from the '
+                                 'previous page. page_number is ignored if '
+                                 'cursor is set.'),
                  ):
         self.page_number = page_number
         self.page_size = page_size
+        self.cursor = cursor
@@ -1,10 +1,33 @@
 from datetime import datetime
+from enum import Enum
+from uuid import UUID
 
 from models.model import Model
 
 
+class HistoryField(str, Enum):
+    id = 'id'
+    user_email = 'user_email'
+    message_content = 'message_content'
+    html_content = 'html_content'
+    last_notification_send = 'last_notification_send'
+
+
+# html_content is big and rarely needed, it's returned only on request
+DEFAULT_HISTORY_FIELDS = [HistoryField.id,
+                          HistoryField.user_email,
+                          HistoryField.message_content,
+                          HistoryField.last_notification_send]
+
+
 class NotificationsHistoryModel(Model):
-    user_email: str
-    message_content: dict
-    html_content: str
-    last_notification_send: datetime
+    id: UUID | None
+    user_email: str | None
+    message_content: dict | None
+    html_content: str | None
+    last_notification_send: datetime | None
+
+
+class NotificationHtmlModel(Model):
+    id: UUID
+    html_content: str | None
@@ -1,8 +1,9 @@
 import uuid
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, String, ForeignKey, Integer
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, DateTime, String, ForeignKey, Integer, \
+    Index, Text, text
+from sqlalchemy.dialects.postgresql import JSONB, UUID
 from sqlalchemy.orm import relationship
 
 from db.postgres import Base
@@ -10,16 +11,29 @@ from db.postgres import Base
 
 class Notification(Base):
     __tablename__ = 'notifications'
-
+    __table_args__ = (
+        # Status updates of consumer and outbox relay
+        Index('ix_notifications_content_id', 'content_id'),
+        # Polling of unfinished notifications, Sent rows are not indexed
+        Index('ix_notifications_status_modified_not_finished',
+              'status', 'modified',
+              postgresql_where=text(
+                  "status IN ('Initiated', 'Produced', 'Consumed')")),
+        # Monthly partitions are managed by schedule.partitions
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+
+    # Primary key of partitioned table includes partition key
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4,
-                unique=True, nullable=False)
+                nullable=False)
     content_id = Column(String,
                         ForeignKey('content.id',
                                    ondelete='CASCADE'),
                         nullable=False)
     routing_key = Column(String, nullable=False)
     status = Column(String, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, primary_key=True, default=datetime.utcnow,
+                        nullable=False)
     modified = Column(DateTime, default=datetime.utcnow)
     failures = Column(Integer, default=0)
     last_notification_send = Column(DateTime, default=None)
@@ -49,14 +63,14 @@ class NotificationContent(Base):
 
     id = Column(String, primary_key=True, default=uuid.uuid4,
                 unique=True, nullable=False)
-    content = Column(String, nullable=True)
+    content = Column(JSONB, nullable=True)
 
     notifications = relationship('Notification',
                                  back_populates='contents')
 
     def __init__(self,
                  _id: str,
-                 content: str):
+                 content: dict):
         self.id = _id
         self.content = content
 
@@ -66,26 +80,89 @@ class NotificationContent(Base):
 
 class NotificationsHistory(Base):
     __tablename__ = 'notifications_history'
-
+    __table_args__ = (
+        # History of user ordered by send time (keyset pagination)
+        Index('ix_notifications_history_user_id_send_id',
+              'user_id', 'last_notification_send', 'id'),
+        # Monthly partitions are managed by schedule.partitions
+        {'postgresql_partition_by': 'RANGE (last_notification_send)'},
+    )
+
+    # Primary key of partitioned table includes partition key
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4,
-                unique=True, nullable=False)
+                nullable=False)
     user_id = Column(UUID, nullable=True)
     user_email = Column(String, nullable=True)
-    message_content = Column(String, nullable=True)
+    message_content = Column(JSONB, nullable=True)
+    # Html is rendered from message_content and template on request, only
+    # old rows have it stored
     html_content = Column(String, nullable=True)
-    last_notification_send = Column(DateTime, default=None)
+    template_hash = Column(String,
+                           ForeignKey('templates.hash'),
+                           nullable=True)
+    last_notification_send = Column(DateTime, primary_key=True,
+                                    default=datetime.utcnow, nullable=False)
 
     def __init__(self,
                  user_id: str,
                  user_email: str,
-                 message_content: str,
-                 html_content: str,
+                 message_content: dict,
+                 template_hash: str,
                  last_notification_send: datetime | None = None) -> None:
         self.user_id = user_id
         self.user_email = user_email
         self.message_content = message_content
-        self.html_content = html_content
-        self.last_notification_send = last_notification_send
+        self.template_hash = template_hash
+        self.last_notification_send = \
+            last_notification_send or datetime.utcnow()
 
     def __repr__(self):
         return f'<History {self.user_id}>'
+
+
+class Outbox(Base):
+    __tablename__ = 'outbox'
+    __table_args__ = (
+        # Relay drains the oldest messages first
+        Index('ix_outbox_created_at', 'created_at'),
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4,
+                unique=True, nullable=False)
+    content_id = Column(String,
+                        ForeignKey('content.id',
+                                   ondelete='CASCADE'),
+                        unique=True,
+                        nullable=False)
+    routing_key = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def __init__(self,
+                 content_id: str,
+                 routing_key: str) -> None:
+        self.content_id = content_id
+        self.routing_key = routing_key
+
+    def __repr__(self):
+        return f'<Outbox {self.content_id}>'
+
+
+class EmailTemplate(Base):
+    __tablename__ = 'templates'
+
+    # sha256 of the source, every version of template is stored once
+    hash = Column(String, primary_key=True, nullable=False)
+    name = Column(String, nullable=False)
+    source = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def __init__(self,
+                 hash_: str,
+                 name: str,
+                 source: str) -> None:
+        self.hash = hash_
+        self.name = name
+        self.source = source
+
+    def __repr__(self):
+        return f'<Template {self.name} {self.hash}>'
@@ -1,19 +1,20 @@
-import ast
 import logging
-import time
 from datetime import datetime
+from typing import AsyncIterator
 
+import msgspec
 from fastapi.encoders import jsonable_encoder
 from sqlalchemy.exc import SQLAlchemyError
 
 import core.config as conf
-from db.rabbit import get_broker
-from models.schemas import Notification, NotificationContent
-from services.connections import get_db, DbHelpers
+from db.postgres import db_session
+from models.messages import LIKES_FOR_REVIEWS, convert
+from models.schemas import Notification, NotificationContent, Outbox
+from services.connections import DbHelpers
 from services.exceptions import db_bad_request
 from services.helpers import process_notifications_helper, \
-    initiate_notification_helper, api_get_helper, api_post_helper
-from message_worker.send_emails import Email
+    initiate_missing_notifications_helper, api_get_helper, api_post_helper
+from message_worker.router import chunk_id, route
 
 
 def success_message(status: str):
@@ -21,47 +22,73 @@ def success_message(status: str):
                         f' good.')
 
 
-async def likes_for_reviews():
+async def daily_likes_pages(size: int) -> AsyncIterator[dict]:
     """
-    Produces message that will be scheduled:
+    Pages of UGC daily likes, at most `size` users in every page.
+    API /api/v1/reviews/users-daily-likes returns:
     {
     "user_id": [
         [
             "movie_id",
-            "movie_title",
+            "movie_title"
             "review_text shortened to 20 signs",
             "likes amount for the last 24 hours"
-        ],
-        [
-            "user_email",
-            "first_name",
-            "last_name",
-        ] - only last element
+        ]
     ]
     }
     """
-    db = await get_db()
-    conn = DbHelpers(db)
-    broker = await get_broker()
-    routing_key = 'user-reporting.v1.likes-for-reviews'
+    url = f'http://{conf.settings.host_ugc}:' \
+          f'{conf.settings.port_ugc}' \
+          f'/api/v1/reviews/users-daily-likes'
+    page_number = 1
+    # Users of previous pages, every user is yielded once
+    seen: set[str] = set()
+    while True:
+        page: dict = await api_get_helper(
+            f'{url}?page_number={page_number}&page_size={size}')
+        if len(page) > size:
+            # UGC returned everything at once, split it here
+            logging.warning('UGC daily likes are not paginated.')
+            items = list(page.items())
+            for i in range(0, len(items), size):
+                yield dict(items[i:i + size])
+            return
+        new = {user_id: likes for user_id, likes in page.items()
+               if user_id not in seen}
+        if page and not new:
+            # UGC ignores page_number and returns the same page again
+            logging.error(f'UGC daily likes page {page_number} repeats '
+                          f'previous pages. Stopping.')
+            return
+        if new:
+            seen.update(new)
+            yield new
+        if len(page) < size:
+            return
+        page_number += 1
+
 
+async def likes_for_reviews():
     """
-    API /api/v1/reviews/users-daily-likes returns:
+    Produces messages that will be scheduled, one message for every chunk
+    of users:
     {
     "user_id": [
         [
             "movie_id",
-            "movie_title"
+            "movie_title",
             "review_text shortened to 20 signs",
             "likes amount for the last 24 hours"
-        ]
+        ],
+        [
+            "user_email",
+            "first_name",
+            "last_name",
+        ] - only last element
     ]
     }
     """
-    url = f'http://{conf.settings.host_ugc}:' \
-          f'{conf.settings.port_ugc}' \
-          f'/api/v1/reviews/users-daily-likes'
-    data_likes: dict = await api_get_helper(url)
+    routing_key = LIKES_FOR_REVIEWS
 
     """
     API /api/v1/users_unauth/user_ids returns:
@@ -80,29 +107,42 @@ async def likes_for_reviews():
     url = f'http://{conf.settings.host_auth}:' \
           f'{conf.settings.port_auth}' \
           f'/api/v1/users_unauth/user_ids'
-    user_ids_list: list = list(data_likes.keys())
-    data_users: list = await api_post_helper(url, user_ids_list)
 
-    # Adding user_data as a last element of dict where key is user_id
-    for user_key in data_likes.keys():
-        for user in data_users:
-            if user_key == user['id']:
-                data_likes[user_key].append([user['email'],
-                                             user['first_name'],
-                                             user['last_name']])
-
-    correlation_id = str(round(time.time()))
-
-    if not data_likes:
+    # Digest is sent once a day. Repeated run skips chunks that have been
+    # initiated already and initiates the rest.
+    digest_id = f'likes-for-reviews:{datetime.utcnow():%Y-%m-%d}'
+    chunks = 0
+    # Only one chunk of users is kept in memory
+    async for data_likes in daily_likes_pages(conf.digest_settings.chunk_size):
+        data_users: list = await api_post_helper(url, list(data_likes))
+        users = {user['id']: user for user in data_users}
+
+        # Adding user_data as a last element of dict where key is user_id
+        data = {}
+        for user_id, likes in data_likes.items():
+            user = users.get(user_id)
+            if user is None:
+                logging.warning(f'User {user_id} doesn\'t exist.')
+                continue
+            data[user_id] = likes + [[user['email'],
+                                      user['first_name'],
+                                      user['last_name']]]
+        if not data:
+            continue
+
+        async with db_session() as db:
+            await initiate_missing_notifications_helper(
+                DbHelpers(db),
+                routing_key,
+                {chunk_id(digest_id, chunks): data})
+        chunks += 1
+
+    if not chunks:
         logging.info('If 0 users received 0 likes - don\'t need to send any'
                      ' notifications. Exiting.')
         return
-
-    await initiate_notification_helper(conn,
-                                       broker,
-                                       correlation_id,
-                                       routing_key,
-                                       data_likes)
+    logging.info(f'Likes for reviews digest {digest_id} has been split into '
+                 f'{chunks} messages.')
 
 
 async def process_initiated_notifications():
@@ -110,57 +150,42 @@ async def process_initiated_notifications():
     Process unfinished notifications in Initiated state
     :return:
     """
-    db = await get_db()
-    conn = DbHelpers(db)
-    routing_key = 'user-reporting.v1.likes-for-reviews'
     status = 'Initiated'
 
     unprocessed = await process_notifications_helper(status, 15)
-    if not unprocessed:
-        success_message(status)
-    else:
-        for notification in unprocessed:
-            notification_dict = jsonable_encoder(*notification)
-            failure = notification_dict['failures']
-            # If there are more than 2 failures in 'Initiated' state - try to
-            # produce message again
-            if failure >= 2:
-                # Get content
-                content_id: str = notification_dict['content_id']
-                content = await conn.select(
-                    NotificationContent,
-                    NotificationContent.id == content_id)
-                content = content.scalar_one()
-
-                # Produce message to the queue
-                broker = await get_broker()
-                await broker.produce(routing_key=routing_key,
-                                     data=jsonable_encoder(content)['content'],
-                                     correlation_id=content_id)
-
-                # Update notification status in DB after producing message
-                try:
-                    await conn.update(model=Notification,
-                                      model_column=Notification.content_id,
-                                      column_value=str(content_id),
-                                      update_values={
-                                          'status': 'Produced',
-                                          'failures': 0,
-                                          'modified': datetime.utcnow()})
-                except SQLAlchemyError as err:
-                    raise db_bad_request(err)
-            else:
-                id_: str = notification_dict['id']
-                try:
-                    await conn.update(model=Notification,
-                                      model_column=Notification.id,
-                                      column_value=str(id_),
-                                      update_values={
-                                          'failures': int(failure) + 1,
-                                          'modified': datetime.utcnow()}
-                                      )
-                except SQLAlchemyError as err:
-                    raise db_bad_request(err)
+    notifications = unprocessed.scalars().all()
+    if not notifications:
+        return success_message(status)
+
+    # If there are more than 2 failures in 'Initiated' state - put message
+    # to the outbox again, otherwise increase failures. Messages that are
+    # still in the outbox are not duplicated.
+    to_enqueue = [n for n in notifications if n.failures >= 2]
+    to_wait = [n.id for n in notifications if n.failures < 2]
+
+    try:
+        async with db_session() as db:
+            conn = DbHelpers(db)
+            if to_enqueue:
+                await conn.insert_missing(
+                    Outbox,
+                    [{'content_id': n.content_id,
+                      'routing_key': n.routing_key} for n in to_enqueue])
+                await conn.update_many(
+                    model=Notification,
+                    model_column=Notification.id,
+                    column_values=[n.id for n in to_enqueue],
+                    update_values={'failures': 0,
+                                   'modified': datetime.utcnow()})
+            if to_wait:
+                await conn.update_many(
+                    model=Notification,
+                    model_column=Notification.id,
+                    column_values=to_wait,
+                    update_values={'failures': Notification.failures + 1,
+                                   'modified': datetime.utcnow()})
+    except SQLAlchemyError as err:
+        raise db_bad_request(err)
 
 
 async def process_produced_notifications():
@@ -188,9 +213,6 @@ async def process_consumed_notifications():
     Process unfinished notifications in Consumed state
     :return:
     """
-    db = await get_db()
-    conn = DbHelpers(db)
-
     status = 'Consumed'
     unprocessed = await process_notifications_helper(status,
                                                      10)
@@ -202,13 +224,15 @@ async def process_consumed_notifications():
             content_id: str = notification_dict['content_id']
             routing_key: str = notification_dict['routing_key']
 
-            message = await conn.select(
-                model=NotificationContent,
-                filter_=NotificationContent.id == content_id)
+            async with db_session() as db:
+                message = await DbHelpers(db).select(
+                    model=NotificationContent,
+                    filter_=NotificationContent.id == content_id)
             message = message.scalar_one()
-            body = ast.literal_eval(message.content)
+            try:
+                payload = convert(routing_key, message.content)
+            except (ValueError, msgspec.ValidationError) as err:
+                logging.error(f'Content of {content_id} is invalid: {err}')
+                continue
 
-            if routing_key == 'user-reporting.v1.registered':
-                await Email().send_registered(body, content_id)
-            elif routing_key == 'user-reporting.v1.likes-for-reviews':
-                await Email().send_likes(body, content_id)
+            await route(routing_key, payload, content_id)
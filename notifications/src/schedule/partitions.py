@@ -0,0 +1,106 @@
+import logging
+from datetime import date, datetime
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from core.config import partition_settings
+from db.postgres import Base, db_session
+from services.exceptions import db_bad_request
+
+SCHEMA = Base.metadata.schema
+
+
+def add_months(month: date, months: int) -> date:
+    """
+    First day of the month `months` after `month`
+    """
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f'{table}_y{month.year}m{month.month:02d}'
+
+
+def partitioned_tables() -> dict[str, int]:
+    """
+    Tables partitioned by month and months of data kept in them, 0 means
+    partitions are never dropped
+    """
+    return {
+        'notifications': partition_settings.notifications_retention,
+        'notifications_history': partition_settings.history_retention,
+    }
+
+
+async def manage_partitions():
+    """
+    Create monthly partitions in advance and drop partitions older than
+    retention period. Dropping a partition is instant and leaves nothing to
+    vacuum, unlike DELETE of the same rows. Months are taken in UTC like
+    timestamps of the rows.
+    :return:
+    """
+    this_month = datetime.utcnow().date().replace(day=1)
+    try:
+        stale: list[tuple[str, str, bool | None, int]] = []
+        async with db_session() as db:
+            for table, retention in partitioned_tables().items():
+                for months in range(partition_settings.premake + 1):
+                    month = add_months(this_month, months)
+                    await db.execute(text(
+                        f'CREATE TABLE IF NOT EXISTS '
+                        f'{SCHEMA}.{partition_name(table, month)} '
+                        f'PARTITION OF {SCHEMA}.{table} FOR VALUES '
+                        f"FROM ('{month}') TO ('{add_months(month, 1)}')"))
+
+                if not retention:
+                    continue
+                oldest = partition_name(table,
+                                        add_months(this_month, -retention))
+                # Partitions and tables left detached by interrupted run,
+                # detach pending is null for them
+                partitions = await db.execute(text(
+                    'SELECT c.relname, i.inhdetachpending FROM pg_class c '
+                    'JOIN pg_namespace n ON n.oid = c.relnamespace '
+                    'LEFT JOIN pg_inherits i ON i.inhrelid = c.oid '
+                    "WHERE n.nspname = :schema AND c.relkind = 'r' "
+                    'AND c.relname ~ :pattern'),
+                    {'schema': SCHEMA,
+                     'pattern': f'^{table}_y[0-9]{{4}}m[0-9]{{2}}$'})
+                # Names sort in month order
+                for name, pending in sorted(partitions.all()):
+                    if name >= oldest:
+                        break
+                    stale.append((table, name, pending, retention))
+            await db.commit()
+
+        for table, name, pending, retention in stale:
+            await drop_partition(table, name, pending)
+            logging.info(f'Partition {name} is older than {retention} '
+                         f'months and has been dropped.')
+    except SQLAlchemyError as err:
+        raise db_bad_request(err)
+
+
+async def drop_partition(table: str, name: str, pending: bool | None):
+    """
+    Detach partition without blocking the partitioned table and drop it.
+    DROP of attached partition would wait for ACCESS EXCLUSIVE lock on the
+    partitioned table and block all queries to it meanwhile.
+    :param table: partitioned table
+    :param name: partition
+    :param pending: detach was interrupted, None if it's detached already
+    :return:
+    """
+    async with db_session() as db:
+        # Concurrent detach can't run in a transaction block
+        conn = await db.connection(
+            execution_options={'isolation_level': 'AUTOCOMMIT'})
+        if pending is not None:
+            mode = 'FINALIZE' if pending else 'CONCURRENTLY'
+            await conn.execute(text(f'ALTER TABLE {SCHEMA}.{table} '
+                                    f'DETACH PARTITION {SCHEMA}.{name} '
+                                    f'{mode}'))
+        await conn.execute(text(f'DROP TABLE {SCHEMA}.{name}'))
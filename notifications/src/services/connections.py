@@ -1,10 +1,14 @@
-from typing import Annotated, Any
+import asyncio
+from typing import Annotated, Any, Callable
 
 from fastapi import Depends
-from sqlalchemy import update, select, Result
+from sqlalchemy import any_, bindparam, insert, update, select, Executable, \
+    Result, Update
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db.postgres import get_session, Base
+from db.postgres import db_session, Base
 from services.postgres import get_postgres
 
 DbDep = Annotated[AsyncSession, Depends(get_postgres)]
@@ -12,20 +16,49 @@ DbDep = Annotated[AsyncSession, Depends(get_postgres)]
 MAX_PAGE_SIZE = 10
 
 
-async def get_db():
-    res = await get_session()
-    return res
-
-
 class DbHelpers:
     def __init__(self, db: AsyncSession):
         self.db = db
 
-    async def insert(self, notification: str) -> None:
+    async def execute(self,
+                      statement: Executable,
+                      params: dict | list[dict]) -> Result:
+        """
+        Execute statement that is defined once with bound parameters, so
+        it is compiled once and prepared once per connection
+        """
+        async with self.db:
+            res = await self.db.execute(statement, params)
+            await self.db.commit()
+            return res
+
+    async def insert_many(self, model: Base, rows: list[dict]) -> None:
+        """
+        Insert all rows with one multi-row INSERT
+        """
+        async with self.db:
+            await self.db.execute(insert(model), rows)
+            await self.db.commit()
+
+    async def insert_all(self, *groups: tuple[Base, list[dict]]) -> None:
+        """
+        Insert rows of several models in one transaction
+        :param groups: model and its rows, inserted in the given order
+        :return:
+        """
+        async with self.db:
+            for model, rows in groups:
+                await self.db.execute(insert(model), rows)
+            await self.db.commit()
+
+    async def insert_missing(self, model: Base, rows: list[dict]) -> None:
+        """
+        Insert rows, rows that conflict with existing ones are skipped
+        """
         async with self.db:
-            self.db.add(notification)
+            await self.db.execute(pg_insert(model).on_conflict_do_nothing(),
+                                  rows)
             await self.db.commit()
-            await self.db.refresh(notification)
 
     async def update(self,
                      model: Base,
@@ -38,11 +71,31 @@ class DbHelpers:
                                   values(**update_values))
             await self.db.commit()
 
+    async def update_many(self,
+                          model: Base,
+                          model_column,
+                          column_values: list,
+                          update_values: dict) -> None:
+        """
+        Update all rows where model_column is in column_values with one
+        statement
+        """
+        async with self.db:
+            await self.db.execute(update(model).
+                                  where(model_column.in_(column_values)).
+                                  values(**update_values))
+            await self.db.commit()
+
     async def select(self,
                      model: Base,
                      filter_,
                      page: int | None = None,
-                     size: int | None = None) -> Result[tuple[Any]]:
+                     size: int | None = None,
+                     order_by: tuple = (),
+                     columns: tuple = ()) -> Result[tuple[Any]]:
+        """
+        Select rows of model, only `columns` are selected if they are set
+        """
         async with self.db:
             if page and size:
                 offset = (page * size) - size
@@ -55,9 +108,73 @@ class DbHelpers:
                 offset = 0
                 size = MAX_PAGE_SIZE
 
-            res = await self.db.execute(select(model).
+            statement = select(*columns) if columns else select(model)
+            res = await self.db.execute(statement.
                                         filter(filter_).
+                                        order_by(*order_by).
                                         offset(offset).
                                         limit(size))
 
             return res
+
+
+class BulkUpdater:
+    """
+    Collects values of model_column from concurrent callers during `delay`
+    seconds and updates all of them with one statement. Caller waits until
+    its row is updated, database errors are raised to every caller.
+    Values are passed as one array parameter, so the statement text doesn't
+    depend on the number of values.
+    """
+
+    def __init__(self,
+                 model: Base,
+                 model_column,
+                 update_values: Callable[[], dict],
+                 delay: float = 0.01) -> None:
+        self.model = model
+        self.model_column = model_column
+        self.update_values = update_values
+        self.delay = delay
+        self.pending: list[tuple[Any, asyncio.Future]] = []
+        self.flusher: asyncio.Task | None = None
+        self.statement: Update | None = None
+
+    def update_statement(self, keys) -> Update:
+        if self.statement is None:
+            values = bindparam('column_values',
+                               type_=ARRAY(self.model_column.type))
+            self.statement = (
+                update(self.model).
+                where(self.model_column == any_(values)).
+                values({key: bindparam(f'new_{key}') for key in keys}).
+                execution_options(synchronize_session=False))
+        return self.statement
+
+    async def add(self, column_value: Any) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((column_value, future))
+        if self.flusher is None:
+            self.flusher = asyncio.create_task(self.flush())
+        await future
+
+    async def flush(self) -> None:
+        await asyncio.sleep(self.delay)
+        pending, self.pending = self.pending, []
+        self.flusher = None
+        try:
+            update_values = self.update_values()
+            params = {f'new_{key}': value
+                      for key, value in update_values.items()}
+            params['column_values'] = [value for value, _ in pending]
+            async with db_session() as db:
+                await DbHelpers(db).execute(
+                    self.update_statement(update_values), params)
+        except Exception as err:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(err)
+        else:
+            for _, future in pending:
+                if not future.done():
+                    future.set_result(None)
@@ -57,6 +57,21 @@ def entity_doesnt_exist(err: Exception) -> HTTPException:
     )
 
 
+notification_not_found = HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Notification not found",
+)
+
+template_not_found = HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Notification template not found",
+)
+
+invalid_cursor = HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor",
+)
+
 too_many_requests = HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
             detail="Too many requests",
@@ -1,18 +1,26 @@
+import asyncio
+import base64
+import binascii
+import uuid
 from datetime import datetime, timedelta
 from typing import Any
 
 import aiohttp
+import orjson
 from fastapi import HTTPException, status
 
-from sqlalchemy import Result, and_
+from sqlalchemy import Result, and_, literal, tuple_
 from sqlalchemy.exc import SQLAlchemyError
 from starlette import status as st
 
-from db import AbstractQueueInternal
+from db.postgres import db_session
+from message_worker.templates import get_template_registry
 from models.schemas import Notification, NotificationContent, \
-    NotificationsHistory
-from services.connections import get_db, DbHelpers
-from services.exceptions import db_bad_request
+    NotificationsHistory, Outbox
+from services.connections import DbHelpers
+from services.exceptions import db_bad_request, invalid_cursor, \
+    notification_not_found, template_not_found
+from services.http_client import get_http_client
 
 
 async def process_notifications_helper(status: str,
@@ -22,81 +30,104 @@ async def process_notifications_helper(status: str,
     Helper for unfinished notifications
     :return:
     """
-    db = await get_db()
-    conn = DbHelpers(db)
     utcnow = datetime.utcnow()
     try:
+        # Status is inlined, so the planner can use the partial index
         expressions: tuple = \
-            (Notification.status == status,
+            (Notification.status == literal(status, literal_execute=True),
              Notification.modified.between(
                  utcnow - timedelta(days=1),
                  utcnow - timedelta(minutes=wait_minutes))
              )
-        unprocessed = await conn.select(
-            Notification,
-            and_(True, *expressions))
+        async with db_session() as db:
+            unprocessed = await DbHelpers(db).select(
+                Notification,
+                and_(True, *expressions))
         return unprocessed
     except SQLAlchemyError as err:
         raise db_bad_request(err)
 
 
+def outbox_groups(routing_key: str,
+                  messages: dict[str, dict]) -> tuple:
+    """
+    Content, notification and outbox rows of new messages
+    :param routing_key:
+    :param messages: data of every message by correlation_id
+    :return:
+    """
+    return ((NotificationContent,
+             [{'id': key, 'content': data}
+              for key, data in messages.items()]),
+            (Notification,
+             [{'content_id': key,
+               'routing_key': routing_key,
+               'status': 'Initiated'} for key in messages]),
+            (Outbox,
+             [{'content_id': key,
+               'routing_key': routing_key} for key in messages]))
+
+
 async def initiate_notification_helper(db_conn: DbHelpers,
-                                       broker: AbstractQueueInternal,
                                        correlation_id: str,
                                        routing_key: str,
                                        data: dict) -> None:
     """
-    Helper to initiate notification
+    Helper to initiate notification. Notification is written to the outbox
+    in the same transaction and published by the outbox relay.
     :param db_conn: Relation DB
-    :param broker: AMQP
     :param correlation_id:
     :param routing_key:
     :param data:
     :return:
     """
-    # Add initial notification to db
     try:
-        await db_conn.insert(NotificationContent(correlation_id,
-                                                 str(data)))
-        await db_conn.insert(Notification(correlation_id,
-                                          routing_key,
-                                          'Initiated'))
+        await db_conn.insert_all(
+            *outbox_groups(routing_key, {correlation_id: data}))
     except SQLAlchemyError as err:
         raise db_bad_request(err)
 
-    # Produce message to the queue
-    await broker.produce(routing_key=routing_key,
-                         data=data,
-                         correlation_id=correlation_id)
 
-    # Update notification status in DB after producing message
+async def initiate_missing_notifications_helper(
+        db_conn: DbHelpers,
+        routing_key: str,
+        messages: dict[str, dict]) -> None:
+    """
+    Helper to initiate several notifications at once. Key of every message
+    is its correlation_id, messages that are already in DB are skipped, so
+    the same messages might be initiated again safely.
+    :param db_conn: Relation DB
+    :param routing_key:
+    :param messages: data of every message by correlation_id
+    :return:
+    """
     try:
-        await db_conn.update(model=Notification,
-                             model_column=Notification.content_id,
-                             column_value=correlation_id,
-                             update_values={'status': 'Produced',
-                                            'modified': datetime.utcnow()})
+        existing = await db_conn.select(
+            NotificationContent,
+            NotificationContent.id.in_(list(messages)),
+            size=len(messages),
+            columns=(NotificationContent.id,))
+        existing_ids = set(existing.scalars())
+        new = {key: data for key, data in messages.items()
+               if key not in existing_ids}
+        if new:
+            await db_conn.insert_all(*outbox_groups(routing_key, new))
     except SQLAlchemyError as err:
         raise db_bad_request(err)
 
 
-async def api_get_helper(url: str,
-                         header: dict | None = None) -> dict | list:
+async def api_request_helper(method: str,
+                             url: str,
+                             retry: bool | None = None,
+                             **kwargs) -> Any:
     """
-    API GET helper:
+    API request helper. Requests are sent with shared HTTP client.
     """
     try:
-        async with aiohttp.ClientSession(headers=header) as session:
-            async with session.get(url=url) as response:
-                body = await response.json()
-                status_code = response.status
-                if status_code != st.HTTP_200_OK:
-                    raise HTTPException(
-                        status_code=status_code,
-                        detail=body['detail'],
-                        headers={"WWW-Authenticate": "Bearer"},
-                    )
-                return body
+        status_code, body = await get_http_client().request(method,
+                                                            url,
+                                                            retry,
+                                                            **kwargs)
     except ConnectionRefusedError as err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=err.strerror)
@@ -109,56 +140,158 @@ async def api_get_helper(url: str,
     except aiohttp.ClientError as err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=err.strerror)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f'{method} {url} timed out')
+    except ValueError:
+        # Body isn't json, e.g. error page of a proxy
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f'{method} {url} returned invalid json')
+
+    if status_code != st.HTTP_200_OK:
+        raise HTTPException(
+            status_code=status_code,
+            detail=body['detail'],
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return body
+
+
+async def api_get_helper(url: str,
+                         header: dict | None = None) -> dict | list:
+    """
+    API GET helper:
+    """
+    return await api_request_helper('GET', url, headers=header)
 
 
 async def api_post_helper(url, user_ids_list):
     """
     API POST helper:
     """
+    # Users lookup doesn't change anything, it's safe to retry
+    return await api_request_helper('POST',
+                                    url,
+                                    retry=True,
+                                    json=user_ids_list)
+
+
+def encode_cursor(last_notification_send: datetime, id_: uuid.UUID) -> str:
+    """
+    Opaque cursor pointing to the history row
+    """
+    raw = orjson.dumps([last_notification_send.isoformat(), str(id_)])
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url=url, json=user_ids_list) as response:
-                body = await response.json()
-                status_code = response.status
-                if status_code != st.HTTP_200_OK:
-                    raise HTTPException(
-                        status_code=status_code,
-                        detail=body['detail'],
-                        headers={"WWW-Authenticate": "Bearer"},
-                    )
-                return body
-    except ConnectionRefusedError as err:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail=err.strerror)
-    except aiohttp.ServerTimeoutError as err:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail=err.strerror)
-    except aiohttp.TooManyRedirects as err:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail=err.strerror)
-    except aiohttp.ClientError as err:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail=err.strerror)
+        last_send, id_ = orjson.loads(base64.urlsafe_b64decode(cursor))
+        return datetime.fromisoformat(last_send), uuid.UUID(id_)
+    except (binascii.Error, orjson.JSONDecodeError, TypeError, ValueError):
+        raise invalid_cursor
 
 
 async def get_notification_history_helper(db_conn: DbHelpers,
                                           user_id: str,
                                           page: int,
-                                          size: int):
+                                          size: int,
+                                          cursor: str | None = None,
+                                          fields: list[str] | None = None):
     """
-    Get notifications history from DB
+    Get notifications history from DB, the newest first. If cursor is set,
+    rows after the cursor are returned and page is ignored.
     :param db_conn: Relation DB
     :param user_id:
     :param page:
     :param size:
+    :param cursor: position of the last row of the previous page
+    :param fields: columns to select, all columns by default. id and
+    last_notification_send are always selected, they are needed for cursor.
+    Html is rendered from message_content and template_hash, they are
+    selected with html_content.
     :return:
     """
+    key = tuple_(NotificationsHistory.last_notification_send,
+                 NotificationsHistory.id)
+    columns: tuple = ()
+    if fields:
+        names = {'id', 'last_notification_send', *fields}
+        if 'html_content' in names:
+            names |= {'message_content', 'template_hash'}
+        columns = tuple(getattr(NotificationsHistory, name)
+                        for name in sorted(names))
+    filter_ = NotificationsHistory.user_id == user_id
+    if cursor:
+        last_send, id_ = decode_cursor(cursor)
+        position = tuple_(
+            literal(last_send,
+                    NotificationsHistory.last_notification_send.type),
+            literal(id_, NotificationsHistory.id.type))
+        filter_ = and_(filter_, key < position)
+        page = 1
     # Get notification from db
     try:
-        data = await db_conn.select(NotificationsHistory,
-                                    NotificationsHistory.user_id == user_id,
-                                    page,
-                                    size)
+        data = await db_conn.select(
+            NotificationsHistory,
+            filter_,
+            page,
+            size,
+            order_by=(NotificationsHistory.last_notification_send.desc(),
+                      NotificationsHistory.id.desc()),
+            columns=columns)
         return data
     except SQLAlchemyError as err:
         raise db_bad_request(err)
+
+
+async def get_notification_html_helper(db_conn: DbHelpers,
+                                       user_id: str,
+                                       notification_id: uuid.UUID
+                                       ) -> str | None:
+    """
+    Get html content of the notification that was sent to user. Html is
+    rendered from the template version the notification was sent with,
+    older notifications have html stored.
+    :param db_conn: Relation DB
+    :param user_id:
+    :param notification_id:
+    :return:
+    """
+    try:
+        data = await db_conn.select(
+            NotificationsHistory,
+            and_(NotificationsHistory.id == notification_id,
+                 NotificationsHistory.user_id == user_id),
+            columns=(NotificationsHistory.html_content,
+                     NotificationsHistory.message_content,
+                     NotificationsHistory.template_hash))
+    except SQLAlchemyError as err:
+        raise db_bad_request(err)
+    row = data.first()
+    if row is None:
+        raise notification_not_found
+    return await render_notification_html(row.html_content,
+                                          row.message_content,
+                                          row.template_hash)
+
+
+async def render_notification_html(html_content: str | None,
+                                   message_content: dict | None,
+                                   template_hash: str | None) -> str | None:
+    """
+    Html of the notification from history
+    :param html_content: html stored before template versions were added
+    :param message_content: template data
+    :param template_hash: version of the template the email was sent with
+    :return:
+    """
+    if template_hash is None:
+        return html_content
+    try:
+        return await get_template_registry().render_version(
+            template_hash, message_content or {})
+    except LookupError:
+        raise template_not_found
+    except SQLAlchemyError as err:
+        raise db_bad_request(err)
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+
+from sqlalchemy.exc import DataError, IntegrityError
+
+from core.config import history_settings
+from db.postgres import db_session
+from models.schemas import NotificationsHistory
+from services.connections import DbHelpers
+
+
+class HistoryWriter:
+    """
+    Buffers notifications history rows and writes them with one multi-row
+    INSERT when `size` rows are collected or `interval` seconds passed after
+    the first buffered row. Batch rejected by a constraint or bad data is
+    split to find the bad rows, they are logged and dropped. Rows that
+    weren't written because DB is unavailable stay in the buffer and are
+    retried by timer, at most `max_rows` of the newest rows are kept.
+    """
+
+    def __init__(self,
+                 size: int,
+                 interval: float,
+                 max_rows: int = 10000) -> None:
+        self.size = size
+        self.interval = interval
+        self.max_rows = max_rows
+        self.rows: list[dict] = []
+        # Last flush failed, buffered rows wait for the timer
+        self.failed = False
+        self.lock = asyncio.Lock()
+        self.timer: asyncio.Task | None = None
+
+    async def add(self, *rows: dict) -> None:
+        self.rows.extend(rows)
+        self.trim()
+        if len(self.rows) >= self.size and not self.failed:
+            await self.flush()
+        # Rows left after failed flush are retried by timer as well
+        if self.rows and self.timer is None:
+            self.timer = asyncio.create_task(self.flush_later())
+
+    async def flush_later(self) -> None:
+        await asyncio.sleep(self.interval)
+        self.timer = None
+        await self.flush()
+        # Rows left after failed flush are retried later
+        if self.rows and self.timer is None:
+            self.timer = asyncio.create_task(self.flush_later())
+
+    async def flush(self) -> None:
+        async with self.lock:
+            if not self.rows:
+                return
+            rows, self.rows = self.rows, []
+            batches = [rows]
+            while batches:
+                batch = batches.pop()
+                try:
+                    async with db_session() as db:
+                        await DbHelpers(db).insert_many(NotificationsHistory,
+                                                        batch)
+                except (DataError, IntegrityError) as err:
+                    if len(batch) == 1:
+                        logging.error(f'Notifications history row is '
+                                      f'dropped: {err}\n{batch[0]}')
+                        continue
+                    # Halves are written in order, the first one is on top
+                    middle = len(batch) // 2
+                    batches += [batch[middle:], batch[:middle]]
+                except Exception as err:
+                    # DB is unavailable, asyncpg connection errors aren't
+                    # wrapped by SQLAlchemy
+                    batches.append(batch)
+                    unwritten = [row for pending in reversed(batches)
+                                 for row in pending]
+                    logging.error(f'Failed to write {len(unwritten)} '
+                                  f'notifications history rows: {err}')
+                    self.rows[:0] = unwritten
+                    self.trim()
+                    self.failed = True
+                    return
+            self.failed = False
+            logging.info(f'{len(rows)} notifications history rows have been '
+                         f'processed.')
+
+    def trim(self) -> None:
+        """
+        Drop the oldest rows over `max_rows`
+        """
+        if len(self.rows) > self.max_rows:
+            dropped = len(self.rows) - self.max_rows
+            del self.rows[:dropped]
+            logging.error(f'{dropped} notifications history rows are lost, '
+                          f'buffer is full.')
+
+    async def close(self) -> None:
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        await self.flush()
+        if self.rows:
+            logging.error(f'{len(self.rows)} notifications history rows are '
+                          f'lost.')
+
+
+history_writer: HistoryWriter | None = None
+
+
+def get_history_writer() -> HistoryWriter:
+    global history_writer
+    if history_writer is None:
+        history_writer = HistoryWriter(
+            size=history_settings.batch_size,
+            interval=history_settings.flush_interval,
+            max_rows=history_settings.max_rows)
+    return history_writer
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import random
+from typing import Any
+
+import aiohttp
+import orjson
+
+from core.config import http_settings
+
+
+class HttpClient:
+    """
+    Application-wide HTTP client. Connections are pooled per host and kept
+    alive between requests. Idempotent requests that failed with connection
+    error, timeout or 502/503/504 are retried with exponential backoff and
+    full jitter.
+    """
+    RETRY_STATUSES = {502, 503, 504}
+    IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+    def __init__(self,
+                 limit_per_host: int,
+                 keepalive_timeout: float,
+                 timeout: float,
+                 connect_timeout: float,
+                 retries: int,
+                 backoff: float) -> None:
+        self.retries = retries
+        self.backoff = backoff
+        connector = aiohttp.TCPConnector(limit_per_host=limit_per_host,
+                                         keepalive_timeout=keepalive_timeout)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=timeout,
+                                          connect=connect_timeout),
+            json_serialize=lambda obj: orjson.dumps(obj).decode())
+
+    async def request(self,
+                      method: str,
+                      url: str,
+                      retry: bool | None = None,
+                      **kwargs) -> tuple[int, Any]:
+        """
+        Returns status code and json body of the response
+        :param method:
+        :param url:
+        :param retry: retry failed request, by default only idempotent
+        methods are retried
+        :param kwargs: arguments of aiohttp request
+        :return:
+        """
+        if retry is None:
+            retry = method in self.IDEMPOTENT_METHODS
+        attempts = self.retries + 1 if retry else 1
+
+        attempt = 1
+        while True:
+            try:
+                async with self.session.request(method,
+                                                url,
+                                                **kwargs) as response:
+                    if response.status not in self.RETRY_STATUSES or \
+                            attempt >= attempts:
+                        body = await response.json(loads=orjson.loads,
+                                                   content_type=None)
+                        return response.status, body
+                    reason = f'status {response.status}'
+            except (aiohttp.ClientConnectionError,
+                    asyncio.TimeoutError) as err:
+                if attempt >= attempts:
+                    raise
+                reason = repr(err)
+
+            delay = random.uniform(0, self.backoff * 2 ** (attempt - 1))
+            logging.warning(f'{method} {url} failed with {reason}. Retry '
+                            f'{attempt} of {attempts - 1} in {delay:.2f}s.')
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def close(self) -> None:
+        await self.session.close()
+
+
+http_client: HttpClient | None = None
+
+
+def create_http_client() -> HttpClient:
+    return HttpClient(limit_per_host=http_settings.limit_per_host,
+                      keepalive_timeout=http_settings.keepalive_timeout,
+                      timeout=http_settings.timeout,
+                      connect_timeout=http_settings.connect_timeout,
+                      retries=http_settings.retries,
+                      backoff=http_settings.retry_backoff)
+
+
+def get_http_client() -> HttpClient:
+    global http_client
+    if http_client is None:
+        http_client = create_http_client()
+    return http_client
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from sqlalchemy import delete, select, update
+
+from db.postgres import db_session
+from db.rabbit import get_broker
+from models.schemas import Notification, NotificationContent, Outbox
+
+
+class OutboxRelay:
+    """
+    Publishes messages written to the outbox together with their
+    notifications. Batch of the oldest rows is locked with
+    FOR UPDATE SKIP LOCKED, so several relays don't publish the same rows.
+    Confirmed messages are moved to `Produced` and removed from the outbox
+    in the same transaction, the rest are published by the next batch.
+    Relay keeps running after DB or broker errors, it waits longer after
+    every failed batch, up to `max_backoff` seconds.
+    """
+
+    def __init__(self,
+                 batch_size: int,
+                 interval: float,
+                 max_backoff: float = 30) -> None:
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.task: asyncio.Task | None = None
+
+    async def drain(self) -> int:
+        """
+        Publish one batch of the outbox
+        :return: number of rows taken from the outbox
+        """
+        async with db_session() as db:
+            rows = (await db.execute(
+                select(Outbox.content_id,
+                       Outbox.routing_key,
+                       NotificationContent.content).
+                join(NotificationContent,
+                     NotificationContent.id == Outbox.content_id).
+                order_by(Outbox.created_at).
+                limit(self.batch_size).
+                with_for_update(of=Outbox, skip_locked=True))).all()
+            if not rows:
+                await db.rollback()
+                return 0
+
+            broker = await get_broker()
+            if broker is None:
+                raise ConnectionError('Rabbit is not connected')
+            produced = await broker.produce_many(
+                [(row.routing_key, row.content, row.content_id)
+                 for row in rows])
+            if produced:
+                # Consumer might have moved the notification further
+                await db.execute(update(Notification).
+                                 where(Notification.content_id.in_(produced),
+                                       Notification.status == 'Initiated').
+                                 values(status='Produced',
+                                        modified=datetime.utcnow()))
+                await db.execute(delete(Outbox).
+                                 where(Outbox.content_id.in_(produced)))
+            await db.commit()
+        return len(rows)
+
+    async def run(self) -> None:
+        failures = 0
+        while True:
+            try:
+                drained = await self.drain()
+            except Exception as err:
+                failures += 1
+                delay = min(self.interval * 2 ** failures, self.max_backoff)
+                logging.error(f'Outbox relay failed: {err!r}. Retry in '
+                              f'{delay:.1f}s.')
+                await asyncio.sleep(delay)
+                continue
+            failures = 0
+            # Full batch means there are more rows waiting
+            if drained < self.batch_size:
+                await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def close(self) -> None:
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+
+outbox_relay: OutboxRelay | None = None
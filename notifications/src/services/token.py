@@ -1,8 +1,17 @@
+import hashlib
 import http
+import time
+from collections import OrderedDict
 
+import jwt
 from fastapi import HTTPException, Request
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
+import core.config as conf
+from services.exceptions import access_token_invalid_exception, \
+    credentials_exception
+from services.helpers import api_get_helper
+
 
 class JWTBearer(HTTPBearer):
     def __init__(self, auto_error: bool = True):
@@ -25,3 +34,101 @@ class JWTBearer(HTTPBearer):
 
 
 security_jwt = JWTBearer()
+
+
+class TokenCache:
+    """
+    LRU cache of users resolved by access token. Keys are sha256 of tokens,
+    entries live `ttl` seconds but not longer than the token itself.
+    """
+
+    def __init__(self, size: int, ttl: float) -> None:
+        self.size = size
+        self.ttl = ttl
+        self.entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> dict | None:
+        key = self.key(token)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, user = entry
+        if expires <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return user
+
+    def set(self, token: str, user: dict, exp: float | None = None) -> None:
+        """
+        :param token:
+        :param user:
+        :param exp: token expiration timestamp
+        :return:
+        """
+        ttl = self.ttl if exp is None else min(self.ttl, exp - time.time())
+        if ttl <= 0:
+            return
+        key = self.key(token)
+        self.entries[key] = (time.monotonic() + ttl, user)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+
+token_cache = TokenCache(size=conf.auth_settings.token_cache_size,
+                         ttl=conf.auth_settings.token_cache_ttl)
+
+
+def decode_token(token: str) -> dict:
+    """
+    Verify token with auth service public key and return its claims, user id
+    claim is required
+    """
+    try:
+        return jwt.decode(token,
+                          conf.auth_settings.public_key,
+                          algorithms=[conf.auth_settings.jwt_algorithm],
+                          options={'require': [
+                              'exp', conf.auth_settings.jwt_user_id_claim]})
+    except jwt.ExpiredSignatureError:
+        raise access_token_invalid_exception
+    except jwt.InvalidTokenError:
+        raise credentials_exception
+
+
+async def get_user(token: str) -> dict:
+    """
+    Returns user for the access token. If public key of auth service is
+    configured token is verified locally, otherwise user is requested from
+    auth service. Results are cached, so revoked token stays valid until
+    its cache entry expires.
+    """
+    user = token_cache.get(token)
+    if user:
+        return user
+
+    if conf.auth_settings.public_key:
+        claims = decode_token(token)
+        user = {'id': claims[conf.auth_settings.jwt_user_id_claim]}
+        exp = claims['exp']
+    else:
+        url = f'http://{conf.settings.host_auth}:' \
+              f'{conf.settings.port_auth}' \
+              f'/api/v1/users/me'
+        headers = {'Authorization': f'Bearer {token}'}
+        user = await api_get_helper(url, headers)
+        # Expiration is only used to limit cache ttl, auth service has
+        # already verified the token
+        try:
+            claims = jwt.decode(token, options={'verify_signature': False})
+            exp = claims.get('exp')
+        except jwt.InvalidTokenError:
+            exp = None
+
+    token_cache.set(token, user, exp)
+    return user
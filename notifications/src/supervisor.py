@@ -0,0 +1,89 @@
+import logging
+import multiprocessing
+import signal
+import time
+from multiprocessing.process import BaseProcess
+
+import consume
+from core.config import consumer_settings
+
+
+class Supervisor:
+    """
+    Runs several consumer processes. Every process has its own connection to
+    RabbitMQ and its own Postgres engine. Crashed processes are restarted,
+    SIGTERM/SIGINT are forwarded to the processes so they can finish
+    in-flight messages before exit.
+    """
+
+    def __init__(self,
+                 workers: int,
+                 restart_delay: float,
+                 shutdown_timeout: float) -> None:
+        self.workers = workers
+        self.restart_delay = restart_delay
+        self.shutdown_timeout = shutdown_timeout
+        # Spawned processes don't inherit supervisor signal handlers
+        self.context = multiprocessing.get_context('spawn')
+        self.processes: list[BaseProcess | None] = [None] * workers
+        self.started_at: list[float] = [0.0] * workers
+        self.stopping = False
+
+    def start_worker(self, slot: int) -> None:
+        process = self.context.Process(target=consume.run,
+                                       name=f'email-worker-{slot}')
+        process.start()
+        self.processes[slot] = process
+        self.started_at[slot] = time.monotonic()
+        logging.info(f'Worker {process.name} started with pid '
+                     f'{process.pid}.')
+
+    def stop(self, signum, frame) -> None:
+        logging.info(f'Supervisor received signal {signum}. Stopping '
+                     f'workers...')
+        self.stopping = True
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for slot in range(self.workers):
+            self.start_worker(slot)
+
+        while not self.stopping:
+            for slot, process in enumerate(self.processes):
+                if process is None or process.is_alive():
+                    continue
+                # Don't restart crashing worker in a tight loop
+                if time.monotonic() - self.started_at[slot] < \
+                        self.restart_delay:
+                    continue
+                logging.error(f'Worker {process.name} (pid {process.pid}) '
+                              f'exited with code {process.exitcode}. '
+                              f'Restarting...')
+                self.start_worker(slot)
+            time.sleep(1)
+
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        alive = [p for p in self.processes if p and p.is_alive()]
+        for process in alive:
+            process.terminate()
+
+        deadline = time.monotonic() + self.shutdown_timeout
+        for process in alive:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logging.error(f'Worker {process.name} (pid {process.pid}) '
+                              f'has not stopped in {self.shutdown_timeout} '
+                              f'seconds. Killing it.')
+                process.kill()
+                process.join()
+        logging.info('All workers have been stopped.')
+
+
+if __name__ == '__main__':
+    Supervisor(workers=consumer_settings.workers,
+               restart_delay=consumer_settings.restart_delay,
+               shutdown_timeout=consumer_settings.shutdown_timeout).run()
@@ -4,6 +4,7 @@ from core.config import cron_settings
 from schedule.notifications import likes_for_reviews, \
     process_initiated_notifications, process_produced_notifications, \
     process_consumed_notifications
+from schedule.partitions import manage_partitions
 
 
 async def jobs(job: AsyncIOScheduler) -> None:
@@ -31,3 +32,9 @@ async def jobs(job: AsyncIOScheduler) -> None:
     job.add_job(process_consumed_notifications,
                 trigger='interval',
                 minutes=cron_settings.process_consumed_notifications['minute'])
+
+    job.add_job(manage_partitions,
+                trigger='cron',
+                hour=cron_settings.manage_partitions['hour'],
+                minute=cron_settings.manage_partitions['minute'],
+                timezone=cron_settings.manage_partitions['timezone'])
@@ -65,6 +65,76 @@ class TestNotifications:
                 body = await response.json()
                 assert body[0]['user_email'] == expected_answer['user_email']
 
+    @pytest.mark.parametrize(
+        'query, expected_answer',
+        [
+            (
+                    {},
+                    {'status': HTTPStatus.OK,
+                     'html_content': 'welcome to our site!'},
+            ),
+        ]
+    )
+    async def test_notification_html(self,
+                                     get_token,
+                                     query,
+                                     expected_answer):
+        access_data = {"username": "admin@example.com",
+                       "password": "Secret123"}
+        access_token = await get_token(access_data)
+        header = {'Authorization': f'Bearer {access_token}'}
+
+        url = settings.service_url + PREFIX + '/get-notifications-history'
+        async with aiohttp.ClientSession(headers=header) as session:
+            async with session.get(url, params=query) as response:
+                assert response.status == expected_answer['status']
+                body = await response.json()
+                assert 'html_content' not in body[0]
+                notification_id = body[0]['id']
+
+            url = settings.service_url + PREFIX + \
+                f'/get-notification-html/{notification_id}'
+            async with session.get(url) as response:
+                assert response.status == expected_answer['status']
+                body = await response.json()
+                assert expected_answer['html_content'] in \
+                       body['html_content']
+
+    @pytest.mark.parametrize(
+        'query, expected_answer',
+        [
+            (
+                    {'page_size': 1},
+                    {'status': HTTPStatus.OK,
+                     'length': 0},
+            ),
+        ]
+    )
+    async def test_notifications_history_cursor(self,
+                                                get_token,
+                                                query,
+                                                expected_answer):
+        access_data = {"username": "admin@example.com",
+                       "password": "Secret123"}
+        access_token = await get_token(access_data)
+        header = {'Authorization': f'Bearer {access_token}'}
+
+        url = settings.service_url + PREFIX + '/get-notifications-history'
+        async with aiohttp.ClientSession(headers=header) as session:
+            async with session.get(url, params=query) as response:
+                assert response.status == expected_answer['status']
+                cursor = response.headers['X-Next-Cursor']
+
+            query = {**query, 'cursor': cursor}
+            async with session.get(url, params=query) as response:
+                assert response.status == expected_answer['status']
+                body = await response.json()
+                assert len(body) == expected_answer['length']
+
+            query = {**query, 'cursor': 'invalid'}
+            async with session.get(url, params=query) as response:
+                assert response.status == HTTPStatus.BAD_REQUEST
+
     @pytest.mark.parametrize(
         'payload, expected_answer',
         [
@@ -0,0 +1,27 @@
+import os
+import sys
+
+# Unit tests import the service from src and don't connect anywhere, only
+# required settings are set
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+for name, value in {'HOST_NOTIFICATION_API': 'localhost',
+                    'PORT_NOTIFICATION_API': '8000',
+                    'HOST_UGC': 'localhost',
+                    'PORT_UGC': '8000',
+                    'HOST_AUTH': 'localhost',
+                    'PORT_AUTH': '8000',
+                    'HOST_CONTENT': 'localhost',
+                    'PORT_CONTENT': '8000',
+                    'MONGO_HOST': 'localhost',
+                    'MONGO_PORT': '27017',
+                    'MONGO_INITDB_DATABASE': 'test',
+                    'RABBIT_HOST': 'localhost',
+                    'RABBIT_PORT': '5672',
+                    'RABBIT_USER': 'test',
+                    'RABBIT_PASS': 'test',
+                    'DB_NAME': 'test',
+                    'DB_USER': 'test',
+                    'DB_PASSWORD': 'test',
+                    'SENDGRID_API_KEY': 'test',
+                    'FROM_EMAIL': 'test@example.com'}.items():
+    os.environ.setdefault(name, value)
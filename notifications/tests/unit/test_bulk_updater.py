@@ -0,0 +1,82 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+from sqlalchemy import Column, String
+from sqlalchemy.orm import DeclarativeBase
+
+import services.connections
+from services.connections import BulkUpdater, DbHelpers
+
+pytestmark = pytest.mark.asyncio
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class Row(Base):
+    __tablename__ = 'rows'
+
+    id = Column(String, primary_key=True)
+    status = Column(String)
+
+
+@pytest.fixture
+def executed(monkeypatch):
+    """
+    Statements executed by BulkUpdater instead of DB
+    """
+    calls: list = []
+
+    @asynccontextmanager
+    async def db_session():
+        yield None
+
+    async def execute(self, statement, params):
+        calls.append((statement, params))
+
+    monkeypatch.setattr(services.connections, 'db_session', db_session)
+    monkeypatch.setattr(DbHelpers, 'execute', execute)
+    return calls
+
+
+def updater() -> BulkUpdater:
+    return BulkUpdater(model=Row,
+                       model_column=Row.id,
+                       update_values=lambda: {'status': 'Sent'})
+
+
+class TestBulkUpdater:
+    async def test_concurrent_values_are_updated_at_once(self, executed):
+        bulk = updater()
+        await asyncio.gather(*(bulk.add(f'id-{i}') for i in range(5)))
+
+        assert len(executed) == 1
+        _, params = executed[0]
+        assert params == {'new_status': 'Sent',
+                          'column_values': [f'id-{i}' for i in range(5)]}
+
+    async def test_statement_is_built_once(self, executed):
+        bulk = updater()
+        await bulk.add('id-1')
+        await asyncio.gather(bulk.add('id-2'), bulk.add('id-3'))
+
+        assert len(executed) == 2
+        assert executed[0][0] is executed[1][0]
+        assert executed[1][1]['column_values'] == ['id-2', 'id-3']
+
+    async def test_error_is_raised_to_every_caller(self, monkeypatch,
+                                                   executed):
+        async def execute(self, statement, params):
+            raise RuntimeError('DB is down')
+
+        monkeypatch.setattr(DbHelpers, 'execute', execute)
+        bulk = updater()
+        results = await asyncio.gather(bulk.add('id-1'),
+                                       bulk.add('id-2'),
+                                       return_exceptions=True)
+
+        assert [str(result) for result in results] == ['DB is down'] * 2
+        assert bulk.pending == []
+        assert bulk.flusher is None
@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from db.rabbit import ChannelPool
+
+pytestmark = pytest.mark.asyncio
+
+
+class FakeChannel:
+    def __init__(self, number: int) -> None:
+        self.number = number
+        self.is_closed = False
+
+    async def get_exchange(self, name: str, ensure: bool = True) -> str:
+        return f'{name}@{self.number}'
+
+    async def close(self) -> None:
+        self.is_closed = True
+
+
+class FakeConnection:
+    def __init__(self) -> None:
+        self.channels: list[FakeChannel] = []
+        self.fail = False
+
+    async def channel(self, publisher_confirms: bool = True) -> FakeChannel:
+        if self.fail:
+            raise ConnectionError('Connection is closed')
+        channel = FakeChannel(len(self.channels))
+        self.channels.append(channel)
+        return channel
+
+
+@pytest.fixture
+def connection() -> FakeConnection:
+    return FakeConnection()
+
+
+class TestChannelPool:
+    async def test_channels_are_reused(self, connection):
+        pool = ChannelPool(connection, 'topic', size=2)
+        async with pool.acquire() as exchange:
+            assert exchange == 'topic@0'
+        async with pool.acquire() as exchange:
+            assert exchange == 'topic@0'
+
+        assert len(connection.channels) == 1
+
+    async def test_concurrent_producers_get_own_channels(self, connection):
+        pool = ChannelPool(connection, 'topic', size=2)
+        used = []
+
+        async def produce():
+            async with pool.acquire() as exchange:
+                used.append(exchange)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(produce() for _ in range(4)))
+
+        assert len(connection.channels) == 2
+        assert sorted(used) == ['topic@0', 'topic@0', 'topic@1', 'topic@1']
+
+    async def test_closed_channel_is_replaced(self, connection):
+        pool = ChannelPool(connection, 'topic', size=1)
+        async with pool.acquire():
+            pass
+        connection.channels[0].is_closed = True
+
+        async with pool.acquire() as exchange:
+            assert exchange == 'topic@1'
+        assert pool.opened == 1
+
+    async def test_channel_closed_while_in_use_is_replaced(self, connection):
+        pool = ChannelPool(connection, 'topic', size=1)
+        async with pool.acquire():
+            connection.channels[0].is_closed = True
+
+        async with pool.acquire() as exchange:
+            assert exchange == 'topic@1'
+
+    async def test_failed_reopen_keeps_slot(self, connection):
+        pool = ChannelPool(connection, 'topic', size=1)
+        async with pool.acquire():
+            connection.channels[0].is_closed = True
+
+        connection.fail = True
+        with pytest.raises(ConnectionError):
+            async with pool.acquire():
+                pass
+
+        connection.fail = False
+        async with pool.acquire() as exchange:
+            assert exchange == 'topic@1'
+        assert pool.opened == 1
+
+    async def test_failed_open_isnt_counted(self, connection):
+        pool = ChannelPool(connection, 'topic', size=1)
+        connection.fail = True
+        with pytest.raises(ConnectionError):
+            async with pool.acquire():
+                pass
+
+        assert pool.opened == 0
+
+    async def test_close(self, connection):
+        pool = ChannelPool(connection, 'topic', size=2)
+        async with pool.acquire():
+            pass
+        await pool.close()
+
+        assert connection.channels[0].is_closed
+        assert pool.opened == 0
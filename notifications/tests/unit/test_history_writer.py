@@ -0,0 +1,128 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+import services.history
+from services.connections import DbHelpers
+from services.history import HistoryWriter
+
+pytestmark = pytest.mark.asyncio
+
+
+class FakeDb:
+    """
+    Written batches. Rows with `bad` are rejected like by a constraint,
+    whole batch fails while `down` is set.
+    """
+
+    def __init__(self) -> None:
+        self.batches: list[list[dict]] = []
+        self.down = False
+        self.error: Exception = OperationalError(
+            'INSERT', {}, Exception('DB is down'))
+
+    async def insert_many(self, model, rows: list[dict]) -> None:
+        if self.down:
+            raise self.error
+        if any(row.get('bad') for row in rows):
+            raise IntegrityError('INSERT', {}, Exception('FK violation'))
+        self.batches.append(list(rows))
+
+    @property
+    def rows(self) -> list[dict]:
+        return [row for batch in self.batches for row in batch]
+
+
+@pytest.fixture
+def db(monkeypatch) -> FakeDb:
+    fake = FakeDb()
+
+    @asynccontextmanager
+    async def db_session():
+        yield None
+
+    async def insert_many(self, model, rows):
+        await fake.insert_many(model, rows)
+
+    monkeypatch.setattr(services.history, 'db_session', db_session)
+    monkeypatch.setattr(DbHelpers, 'insert_many', insert_many)
+    return fake
+
+
+def rows(*ids, **fields) -> list[dict]:
+    return [{'id': id_, **fields} for id_ in ids]
+
+
+class TestHistoryWriter:
+    async def test_flush_on_size(self, db):
+        writer = HistoryWriter(size=3, interval=60)
+        await writer.add(*rows(1, 2))
+        assert db.batches == []
+
+        await writer.add(*rows(3))
+        assert db.batches == [rows(1, 2, 3)]
+        await writer.close()
+
+    async def test_flush_on_interval(self, db):
+        writer = HistoryWriter(size=100, interval=0.01)
+        await writer.add(*rows(1))
+        await writer.add(*rows(2))
+        await asyncio.sleep(0.05)
+
+        assert db.batches == [rows(1, 2)]
+        assert writer.timer is None
+        await writer.close()
+
+    async def test_flush_on_close(self, db):
+        writer = HistoryWriter(size=100, interval=60)
+        await writer.add(*rows(1, 2))
+        await writer.close()
+
+        assert db.batches == [rows(1, 2)]
+        assert writer.timer is None
+
+    async def test_bad_rows_are_dropped(self, db):
+        writer = HistoryWriter(size=5, interval=60)
+        await writer.add(*rows(1, 2), *rows(3, bad=True), *rows(4, 5))
+
+        assert db.rows == rows(1, 2, 4, 5)
+        assert writer.rows == []
+        assert not writer.failed
+        await writer.close()
+
+    async def test_rows_are_kept_while_db_is_down(self, db):
+        db.down = True
+        writer = HistoryWriter(size=2, interval=60, max_rows=3)
+        await writer.add(*rows(1, 2))
+        assert writer.failed
+        assert writer.rows == rows(1, 2)
+
+        # Failed writer doesn't retry on every add, the oldest rows are
+        # dropped over max_rows
+        await writer.add(*rows(3, 4))
+        assert writer.rows == rows(2, 3, 4)
+
+        db.down = False
+        await writer.close()
+        assert db.rows == rows(2, 3, 4)
+        assert not writer.failed
+
+    async def test_rows_are_kept_on_connection_error(self, db):
+        db.down = True
+        db.error = ConnectionRefusedError('Connect call failed')
+        writer = HistoryWriter(size=2, interval=0.01)
+        await writer.add(*rows(1, 2))
+        assert writer.failed
+        assert writer.rows == rows(1, 2)
+
+        # Timer keeps retrying until DB is back
+        await asyncio.sleep(0.03)
+        assert writer.timer is not None
+        db.down = False
+        await asyncio.sleep(0.03)
+        assert db.rows == rows(1, 2)
+        assert writer.rows == []
+        assert not writer.failed
+        await writer.close()
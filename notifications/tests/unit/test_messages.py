@@ -0,0 +1,66 @@
+from typing import Any
+
+import msgspec
+import orjson
+import pytest
+
+from models.messages import LIKES_FOR_REVIEWS, REGISTERED, \
+    USER_LIKES_FOR_REVIEWS, UserLikesForReviews, UserRegistered, convert, \
+    decode, encode
+
+USER: dict[str, Any] = {'id': '6c0dd299-63ad-4fd0-89de-790b0789fb50',
+                        'email': 'admin@example.com',
+                        'first_name': 'admin',
+                        'last_name': None,
+                        'disabled': False,
+                        'roles': []}
+DIGEST = {USER['id']: [['movie-1', 'Movie title', 'Review text', 10],
+                       [USER['email'], 'admin', None]]}
+USER_LIKES = {'id': USER['id'],
+              'email': USER['email'],
+              'first_name': 'admin',
+              'last_name': None,
+              'reviews': DIGEST[USER['id']][:-1]}
+
+
+class TestMessages:
+    def test_envelope(self):
+        assert orjson.loads(encode(USER)) == {'v': 1, 'data': USER}
+
+    @pytest.mark.parametrize('routing_key, data, expected', [
+        (REGISTERED, USER,
+         UserRegistered(id=USER['id'],
+                        email=USER['email'],
+                        first_name='admin',
+                        last_name=None)),
+        (LIKES_FOR_REVIEWS, DIGEST, DIGEST),
+        (USER_LIKES_FOR_REVIEWS, USER_LIKES,
+         UserLikesForReviews(**USER_LIKES)),
+    ])
+    def test_decode(self, routing_key, data, expected):
+        assert decode(routing_key, encode(data)) == expected
+        # Published before the envelope was added
+        assert decode(routing_key, orjson.dumps(data)) == expected
+        # Content stored in DB
+        assert convert(routing_key, data) == expected
+
+    def test_invalid_payload_in_envelope(self):
+        body = encode({**USER, 'email': None})
+        with pytest.raises(msgspec.ValidationError, match=r'\$\.data\.email'):
+            decode(REGISTERED, body)
+
+    def test_invalid_legacy_payload(self):
+        body = orjson.dumps({**USER, 'email': None})
+        with pytest.raises(msgspec.ValidationError, match=r'\$\.email'):
+            decode(REGISTERED, body)
+
+    def test_wrong_version(self):
+        body = orjson.dumps({'v': 2, 'data': USER})
+        with pytest.raises(msgspec.ValidationError, match='version 2'):
+            decode(REGISTERED, body)
+
+    def test_unknown_routing_key(self):
+        with pytest.raises(ValueError, match='Unknown routing key'):
+            decode('user-reporting.v1.unknown', encode(USER))
+        with pytest.raises(ValueError, match='Unknown routing key'):
+            convert('user-reporting.v1.unknown', USER)
@@ -0,0 +1,10 @@
+from message_worker.router import chunk_id, digest_of
+
+
+class TestDigestOf:
+    def test_chunk_id(self):
+        assert digest_of(chunk_id('2026-10-18', 3)) == '2026-10-18'
+
+    def test_id_without_chunk_number(self):
+        correlation_id = '6c0dd299-63ad-4fd0-89de-790b0789fb50'
+        assert digest_of(correlation_id) == correlation_id
@@ -0,0 +1,112 @@
+import pytest
+
+from core.config import email_settings
+from message_worker.send_emails import Email
+from message_worker.transport import DeliveryError, TransportResponse
+
+pytestmark = pytest.mark.asyncio
+
+DIGEST = {f'user-{i}': [['movie', 'Movie title', 'Review text', 10],
+                        [f'user{i}@example.com', 'First', 'Last']]
+          for i in range(3)}
+
+
+class Split:
+    skeleton = 'skeleton'
+
+    @staticmethod
+    def assemble(slots: dict) -> str:
+        return 'html'
+
+
+class Templates:
+    def split(self, name: str) -> Split:
+        return Split()
+
+    def render_slots(self, name: str, **context) -> dict:
+        return {}
+
+    async def version(self, name: str) -> str:
+        return 'hash'
+
+
+class Transport:
+    """
+    Delivered recipients, `errors` are raised for recipients instead
+    """
+
+    def __init__(self, errors: dict[str, Exception] | None = None) -> None:
+        self.errors = errors or {}
+        self.delivered: list[str] = []
+
+    async def send(self, message) -> TransportResponse:
+        to_email = message.personalizations[0].tos[0]['email']
+        if to_email in self.errors:
+            raise self.errors[to_email]
+        self.delivered.append(to_email)
+        return TransportResponse(202, '', {})
+
+    async def close(self) -> None:
+        pass
+
+
+@pytest.fixture
+def db(monkeypatch) -> dict:
+    """
+    Status and content of the notification, history rows
+    """
+    state: dict = {'status': 'Consumed', 'content': None, 'history': []}
+
+    async def message_already_sent(correlation_id):
+        return None
+
+    async def keep_undelivered(correlation_id, data):
+        state['content'] = data
+
+    async def change_db_status(correlation_id):
+        state['status'] = 'Sent'
+
+    async def add_notifications_history(user_id, *args):
+        if user_id in state.get('history_errors', ()):
+            raise RuntimeError('History is unavailable')
+        state['history'].append(user_id)
+
+    monkeypatch.setattr(email_settings, 'sg_batch_size', 1)
+    for fn in (message_already_sent, keep_undelivered, change_db_status,
+               add_notifications_history):
+        monkeypatch.setattr(Email, fn.__name__, staticmethod(fn))
+    return state
+
+
+class TestSendLikes:
+    async def test_all_delivered(self, db):
+        transport = Transport()
+        await Email(transport, Templates()).send_likes(DIGEST, 'digest')
+
+        assert len(transport.delivered) == 3
+        assert db['status'] == 'Sent'
+        assert db['history'] == list(DIGEST)
+
+    async def test_delivery_error(self, db):
+        transport = Transport({'user1@example.com': DeliveryError(500, '')})
+        await Email(transport, Templates()).send_likes(DIGEST, 'digest')
+
+        assert db['status'] == 'Consumed'
+        assert list(db['content']) == ['user-1']
+
+    async def test_unexpected_error_keeps_delivered(self, db):
+        transport = Transport({'user1@example.com': RuntimeError('Bug')})
+        with pytest.raises(RuntimeError):
+            await Email(transport, Templates()).send_likes(DIGEST, 'digest')
+
+        assert transport.delivered == ['user0@example.com']
+        assert list(db['content']) == ['user-1', 'user-2']
+
+    async def test_history_error_after_delivery(self, db):
+        db['history_errors'] = {'user-1'}
+        transport = Transport()
+        with pytest.raises(RuntimeError):
+            await Email(transport, Templates()).send_likes(DIGEST, 'digest')
+
+        # Batch of user-1 is delivered, it isn't sent again
+        assert list(db['content']) == ['user-2']
@@ -0,0 +1,52 @@
+import pytest
+
+from message_worker.templates import TEMPLATES_PATH, TemplateRegistry
+
+TEMPLATE = 'email_likes_for_review.html'
+
+
+@pytest.fixture(scope='module')
+def registry() -> TemplateRegistry:
+    registry = TemplateRegistry(TEMPLATES_PATH)
+    registry.load()
+    return registry
+
+
+def context(first_name: str, last_name: str = 'Last',
+            review: str = 'Review text') -> dict:
+    return {'first_name': first_name,
+            'last_name': last_name,
+            'reviews': [['movie-1', 'Movie title', review, 10],
+                        ['movie-2', 'Other title', 'Second', 3]]}
+
+
+class TestSplitTemplate:
+    def test_assembled_html_is_rendered_html(self, registry):
+        split = registry.split(TEMPLATE)
+        ctx = context('First')
+
+        assert split.assemble(split.slots(**ctx)) == \
+            registry.get(TEMPLATE).render(**ctx)
+
+    @pytest.mark.parametrize('value', [
+        '-reviews-',
+        '-first_name-',
+        '{{ reviews }}',
+        '<b>First</b>',
+        '$1 \\1 \\g<0>',
+    ])
+    def test_hostile_values_are_kept(self, registry, value):
+        split = registry.split(TEMPLATE)
+        # Values that look like tags of this very template too
+        for ctx in (context(value, value, value),
+                    context(split.tag('reviews'),
+                            split.tag('first_name'),
+                            split.tag('last_name'))):
+            assert split.assemble(split.slots(**ctx)) == \
+                registry.get(TEMPLATE).render(**ctx)
+
+    def test_tags_are_unique_per_template(self, registry):
+        split = registry.split(TEMPLATE)
+        for name in ('first_name', 'last_name', 'reviews'):
+            assert split.skeleton.count(split.tag(name)) == 1
+            assert split.tag(name) != f'-{name}-'
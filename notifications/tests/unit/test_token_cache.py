@@ -0,0 +1,91 @@
+import time
+
+import jwt
+import pytest
+from fastapi import HTTPException
+
+import core.config as conf
+import services.token
+from services.exceptions import credentials_exception
+from services.token import TokenCache, get_user
+
+USER = {'id': '6c0dd299-63ad-4fd0-89de-790b0789fb50'}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Monotonic and wall clock moved by the test
+    """
+    now = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    return now
+
+
+class TestTokenCache:
+    def test_entry_expires_after_ttl(self, clock):
+        cache = TokenCache(size=10, ttl=60)
+        cache.set('token', USER)
+        assert cache.get('token') == USER
+
+        clock[0] += 60
+        assert cache.get('token') is None
+        assert cache.entries == {}
+
+    def test_entry_doesnt_outlive_token(self, clock):
+        cache = TokenCache(size=10, ttl=60)
+        cache.set('token', USER, exp=clock[0] + 10)
+
+        clock[0] += 10
+        assert cache.get('token') is None
+
+    def test_expired_token_isnt_cached(self, clock):
+        cache = TokenCache(size=10, ttl=60)
+        cache.set('token', USER, exp=clock[0] - 1)
+
+        assert cache.entries == {}
+
+    def test_least_recently_used_entry_is_evicted(self, clock):
+        cache = TokenCache(size=2, ttl=60)
+        cache.set('first', USER)
+        cache.set('second', USER)
+        assert cache.get('first') == USER
+
+        cache.set('third', USER)
+        assert cache.get('second') is None
+        assert cache.get('first') == USER
+        assert cache.get('third') == USER
+
+    def test_tokens_arent_kept_in_keys(self, clock):
+        cache = TokenCache(size=10, ttl=60)
+        cache.set('token', USER)
+
+        assert 'token' not in cache.entries
+        assert cache.key('token') in cache.entries
+
+
+@pytest.fixture
+def local_jwt(monkeypatch):
+    """
+    Tokens are verified locally with a shared secret
+    """
+    monkeypatch.setattr(conf.auth_settings, 'jwt_public_key', 'secret')
+    monkeypatch.setattr(conf.auth_settings, 'jwt_algorithm', 'HS256')
+    monkeypatch.setattr(services.token, 'token_cache',
+                        TokenCache(size=10, ttl=60))
+
+
+@pytest.mark.asyncio
+class TestGetUser:
+    async def test_user_from_claims(self, local_jwt):
+        token = jwt.encode({'sub': 'user-id', 'exp': time.time() + 60},
+                           'secret', algorithm='HS256')
+        assert await get_user(token) == {'id': 'user-id'}
+
+    async def test_token_without_user_id(self, local_jwt):
+        token = jwt.encode({'exp': time.time() + 60},
+                           'secret', algorithm='HS256')
+        with pytest.raises(HTTPException) as err:
+            await get_user(token)
+        assert err.value is credentials_exception